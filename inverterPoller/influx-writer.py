@@ -1,35 +1,111 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import asyncio
+import os
+import signal
 import subprocess
+import sys
 import syslog
 import json
-from datetime import datetime
 import influxdb
 import time
 
+# the poller child, clock, precisions, mapping, warning mask and adaptive rate
+# are the ones of mppsolar/influx-writer.py, imported from its directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mppsolar'))
+
+import adaptive
+import clock
+import lineprotocol
+import mapping
+import transport
+import warningmask
+
 class Inverter:
     # init class loading config file value
     def __init__(self, config_path):
+        self.config_path = config_path
+        self.conf = self.LoadConf()
+        # checked between two samples: SIGHUP sets reload_requested, and the
+        # file is looked at every reload.watch_interval seconds
+        self.reload_requested = False
+        self.conf_stamp = self.ConfStamp()
+        self.next_check = time.monotonic()
+        self.Configure(self.conf)
+        self.warning_mask = 0
+        # keep a single poller process running when the config provides one
+        self.poller_child = None
+        if "child" in self.conf["inverterPoller"]:
+            self.poller_child = transport.ChildTransport(self.conf["inverterPoller"])
+
+    def LoadConf(self):
         try:
-            with open(config_path, "r") as jsonfile:
-                config = json.load(jsonfile)
-                # store the wall config in this var to update the config file
-                self.conf = config
+            with open(self.config_path, "r") as jsonfile:
+                return json.load(jsonfile)
         except Exception as e:
             syslog.syslog(syslog.LOG_ERR, 'Failed to load configuration: {}'.format(e))
             raise e
-        # retreive api hello-asso api token to perform authenticate queries
-        self.influx_client = influxdb.InfluxDBClient(
-            self.conf["influx"]["host"], 
-            self.conf["influx"]["port"], 
-            self.conf["influx"]["user"], 
-            self.conf["influx"]["password"], 
-            self.conf["influx"]["database"]
-        )
 
+    def Configure(self, conf, changed=None):
+        # build what the changed sections need (all of it at startup), then
+        # swap it in at once
+        built = {}
+        if changed is None or "influx" in changed:
+            # retreive api hello-asso api token to perform authenticate queries
+            built["influx_client"] = influxdb.InfluxDBClient(
+                conf["influx"]["host"],
+                conf["influx"]["port"],
+                conf["influx"]["user"],
+                conf["influx"]["password"],
+                conf["influx"]["database"]
+            )
+            # utc stamps taken when the poller answers, written in this precision
+            built["precision"] = lineprotocol.PRECISIONS[conf["influx"].get("precision", "ns")]
+        if changed is None or "mapping" in changed:
+            built["mappers"] = mapping.NewMappers(conf.get("mapping", {}), mapping.POLLER_MAPPING, 'dict')
+        if changed is None or "adaptive" in changed:
+            # polling rate following the signal instead of one poll a second
+            built["adaptive"] = adaptive.AdaptiveRate(conf["adaptive"]) if "adaptive" in conf else None
+        for name, value in built.items():
+            setattr(self, name, value)
+        self.conf = conf
+
+    def ConfStamp(self):
+        try:
+            stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def ReloadIfChanged(self):
+        # the poller child and the warning mask survive a reload, only the
+        # influx client and the mapping are rebuilt when their section changed
+        interval = self.conf.get("reload", {}).get("watch_interval", 5)
+        if not self.reload_requested and (not interval or time.monotonic() < self.next_check):
+            return
+        self.next_check = time.monotonic() + (interval or 0)
+        stamp = self.ConfStamp()
+        if not self.reload_requested and stamp == self.conf_stamp:
+            return
+        self.reload_requested = False
+        self.conf_stamp = stamp
+        try:
+            conf = self.LoadConf()
+            changed = {key for key in set(self.conf) | set(conf) if self.conf.get(key) != conf.get(key)}
+            if "inverterPoller" in changed and self.poller_child is not None:
+                # the path is read on every spawn, a running child is kept though
+                syslog.syslog(syslog.LOG_WARNING, 'inverterPoller changed, a restart is needed to apply it to the poller child')
+            self.Configure(conf, changed)
+        except Exception as e:
+            syslog.syslog(syslog.LOG_ERR, 'config reload failed, keeping the running one: {}'.format(e))
+            return
+        if changed:
+            syslog.syslog(syslog.LOG_INFO, 'config reloaded, changed: {}'.format(', '.join(sorted(changed))))
 
     def PolInverter(self):
+        if self.poller_child is not None:
+            return self.poller_child.Send("poll")
         try:
             inverter_data = subprocess.check_output([self.conf["inverterPoller"]["path"], '-1'])
         except subprocess.CalledProcessError as e:
@@ -38,125 +114,126 @@ class Inverter:
 
         return json.loads(inverter_data.decode('utf-8'))
 
-    def MapData(self, data):
-        #TODO maybe store the mapping into the config file to change it easily without touching code
-        date = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-        payload = [
-            {
-                "measurement": "battery",
-                "tags": {
-                    "id": 1
-                },
-                "time": date,
-                "fields": {
-                    "DC_V": data['Battery_voltage'],
-                    "DC_V_scc": data['SCC_voltage'],
-                    "charging_current": data['Battery_charge_current'],
-                    "discharge_current": data['Battery_discharge_current'],
-                    "soc": data['Battery_capacity'],
-                    "recharge_voltage": data['Battery_recharge_voltage'],
-                    "under_voltage": data['Battery_under_voltage'],
-                    "bulk_voltage": data['Battery_bulk_voltage'],
-                    "float_voltage": data['Battery_float_voltage'],
-                    "re_discharge_voltage": data['Battery_redischarge_voltage']
-                }
-            },
-            {
-                "measurement": "pv",
-                "tags": {
-                    "id": 1
-                },
-                "time": date,
-                "fields": {
-                    "DC_V": data['PV_in_voltage'],
-                    "A": data['PV_in_current'],
-                    "W": data['PV_in_watts'],
-                    "Wh": data['PV_in_watthour']
-                }
-            },
-            {
-                "measurement": "grid",
-                "tags": {
-                    "id": 1
-                },
-                "time": date,
-                "fields": {
-                    "AC_V": data['AC_grid_voltage'],
-                    "Hz": data['AC_grid_frequency'],
-                    "max_grid_charge_current": data['Max_grid_charge_current']
-                }
-            },
-            {
-                "measurement": "out",
-                "tags": {
-                    "id": 1
-                },
-                "time": date,
-                "fields": {
-                    "AC_V": data['AC_out_voltage'],
-                    "Hz": data['AC_out_frequency'],
-                    "load_watt": data['Load_watt'],
-                    "load_watthour": data['Load_watthour'],
-                    "load_percent": data['Load_pct'],
-                    "load_va": data['Load_va']
-                }
-            },
-            {
-                "measurement": "inverter",
-                "tags": {
-                    "id": 1
-                },
-                "time": date,
-                "fields": {
-                    "bus_voltage": data['Bus_voltage'],
-                    "heat_sink_temperature": data['Heatsink_temperature'],
-                    "max_charge_current": data['Max_charge_current'],
-                    "inverter_mode": data['Inverter_mode'],
-                    "load_status_on": data['Load_status_on'],
-                    "scc_charge_on": data['SCC_charge_on'],
-                    "ac_charge_on": data['AC_charge_on'],
-                    "output_source_priority": data['Out_source_priority'],
-                    "charger_source_priority": data['Charger_source_priority'],
-                    "warnings": inverter.MapBitfieldToWarnings(data['Warnings'])
-                }
-            }
-        ]
-        return payload
+    def Stamp(self):
+        return clock.Now() // self.precision[0]
+
+    def MapData(self, data, date):
+        # the mapping is compiled once, see mapping.POLLER_MAPPING and the mapping config section
+        # with an adaptive rate the points are tagged with the interval they were polled at
+        tags = {"id": 1}
+        if self.adaptive is not None:
+            tags["interval"] = self.adaptive.Tag()
+        payload = self.mappers["data"].Map(data, date, tags)
+        if self.adaptive is not None:
+            self.adaptive.Observe({point["measurement"]: point["fields"] for point in payload})
+        return payload + self.MapBitfieldToWarnings(data["Warnings"], date)
+
+    def MapBitfieldToWarnings(self, bits, date):
+        # the Warnings bit string is kept as an integer mask, a xor against the
+        # previous one gives the warnings raised or cleared since the last poll
+        mask = warningmask.Parse(bits)
+        previous = self.warning_mask
+        self.warning_mask = mask
+        if self.adaptive is not None and mask & ~previous:
+            # a warning was raised, poll the transient at the fast rate
+            self.adaptive.Alert()
+        if mask == previous:
+            return []
+        # the events are lineprotocol tuples, written as influxdb client dicts here
+        return [{'measurement': measurement, 'tags': dict(tags), 'time': stamp, 'fields': fields}
+                for measurement, tags, fields, stamp in warningmask.Events(previous, mask, (('id', 1),), date)]
 
     def InfluxWrite(self, payload):
         try:
-            self.influx_client.write_points(payload)
+            self.influx_client.write_points(payload, time_precision=self.precision[1])
             print("Write points: {0}".format(payload))
         except influxdb.exceptions.InfluxDBClientError as e:
             syslog.syslog(syslog.LOG_WARNING, '{} database not found, intempting to create now'.format(self.conf["influx"]["database"]))
             self.influx_client.create_database(self.conf["influx"]["database"])
             print("DB created, writing points: {0}".format(payload))
-            self.influx_client.write_points(payload)
+            self.influx_client.write_points(payload, time_precision=self.precision[1])
 
     def Run(self):
         syslog.syslog(syslog.LOG_INFO, "influx-writer started")
         while True:
+            self.ReloadIfChanged()
             failCount = 0
             try:
                 rawData = self.PolInverter()
+                date = self.Stamp()
                 failCount = 0
             except Exception as e:
                 syslog.syslog(syslog.LOG_ERR, 'Failed to poll inverter {}'.format(e))
                 failCount += 1
 
             if failCount == 0:
-                #TODO find a nice way to store activated warnings and make a use of MapBitfieldToWarnings function
-                payload = self.MapData(rawData)
+                payload = self.MapData(rawData, date)
                 self.InfluxWrite(payload)
             elif failCount > 3:
                 syslog.syslog(syslog.LOG_ERR, '{} inverter polling failed in a raw, exiting process'.format(e))
                 exit(-1)
-            time.sleep(1)
+            time.sleep(self.Interval())
+
+    def Interval(self):
+        return 1 if self.adaptive is None else self.adaptive.interval
+
+    async def PolInverterAsync(self):
+        if self.poller_child is not None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.poller_child.Send, "poll")
+        process = await asyncio.create_subprocess_exec(self.conf["inverterPoller"]["path"], '-1', stdout=asyncio.subprocess.PIPE)
+        inverter_data, _ = await process.communicate()
+        if process.returncode:
+            e = subprocess.CalledProcessError(process.returncode, self.conf["inverterPoller"]["path"])
+            syslog.syslog(syslog.LOG_ERR, 'inverter_poller returned with error {}'.format(e))
+            raise e
+
+        return json.loads(inverter_data.decode('utf-8'))
+
+    async def PollTask(self, queue):
+        # poll on a 1s grid (or the adaptive one) whatever the time influx takes to answer
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        failCount = 0
+        while True:
+            self.ReloadIfChanged()
+            try:
+                rawData = await self.PolInverterAsync()
+                date = self.Stamp()
+                failCount = 0
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(self.MapData(rawData, date))
+            except Exception as e:
+                syslog.syslog(syslog.LOG_ERR, 'Failed to poll inverter {}'.format(e))
+                failCount += 1
+                if failCount > 3:
+                    syslog.syslog(syslog.LOG_ERR, '{} inverter polling failed in a raw, exiting process'.format(e))
+                    exit(-1)
+            deadline = max(deadline + self.Interval(), loop.time())
+            await asyncio.sleep(deadline - loop.time())
+
+    async def WriteTask(self, queue):
+        while True:
+            payload = await queue.get()
+            try:
+                await asyncio.to_thread(self.InfluxWrite, payload)
+            except Exception as e:
+                syslog.syslog(syslog.LOG_ERR, 'Failed to write points {}'.format(e))
+
+    async def RunAsync(self):
+        syslog.syslog(syslog.LOG_INFO, "influx-writer started (asyncio)")
+        queue = asyncio.Queue(self.conf["influx"].get("queue_size", 100))
+        await asyncio.gather(self.PollTask(queue), self.WriteTask(queue))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--conf', help='path to a config file')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='poll and write from concurrent asyncio tasks')
     args = parser.parse_args()
 
     inverter = Inverter(args.conf)
-    inverter.Run()
+    signal.signal(signal.SIGHUP, lambda signum, frame: setattr(inverter, 'reload_requested', True))
+    if args.use_async:
+        asyncio.run(inverter.RunAsync())
+    else:
+        inverter.Run()
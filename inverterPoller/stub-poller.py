@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import sys
+
+# stand-in for inverter_poller: `-1` prints one sample and exits, `--serve`
+# answers a sample per line read on stdin like a persistent poller child would
+SAMPLE = {
+    "Inverter_mode": 4,
+    "AC_grid_voltage": 231.4,
+    "AC_grid_frequency": 49.9,
+    "AC_out_voltage": 230.1,
+    "AC_out_frequency": 50.0,
+    "PV_in_voltage": 118.4,
+    "PV_in_current": 7.0,
+    "PV_in_watts": 829.0,
+    "PV_in_watthour": 0.2303,
+    "SCC_voltage": 52.61,
+    "Load_pct": 11,
+    "Load_watt": 498,
+    "Load_watthour": 0.1383,
+    "Load_va": 552,
+    "Bus_voltage": 392,
+    "Heatsink_temperature": 38,
+    "Battery_capacity": 87,
+    "Battery_voltage": 52.6,
+    "Battery_charge_current": 12,
+    "Battery_discharge_current": 0,
+    "Load_status_on": 1,
+    "SCC_charge_on": 1,
+    "AC_charge_on": 0,
+    "Battery_recharge_voltage": 46.0,
+    "Battery_under_voltage": 42.0,
+    "Battery_bulk_voltage": 56.4,
+    "Battery_float_voltage": 54.0,
+    "Max_grid_charge_current": 30,
+    "Max_charge_current": 60,
+    "Out_source_priority": 2,
+    "Charger_source_priority": 2,
+    "Battery_redischarge_voltage": 54.0,
+    "Warnings": "00000000000000000000000000000000",
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-1", dest="once", action="store_true")
+    parser.add_argument("--serve", action="store_true")
+    args = parser.parse_args()
+
+    if args.serve:
+        for line in sys.stdin:
+            sys.stdout.write(json.dumps(SAMPLE) + "\n")
+            sys.stdout.flush()
+    else:
+        print(json.dumps(SAMPLE))
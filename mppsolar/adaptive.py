@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+# measurement.field -> change between two samples that brings the fast rate
+DEFAULT_THRESHOLDS = {
+    "out.load_watt": 100,
+    "pv.W": 100,
+    "grid.AC_V": 10,
+    "battery.DC_V": 0.5,
+}
+
+
+def Series(tags):
+    # the tags of a point without the interval tag: one series for the rollups
+    # and the change filter whatever the rate it was sampled at
+    if len(tags) < 2:
+        return tags
+    return tuple(tag for tag in tags if tag[0] != "interval")
+
+
+def Minutes(clock):
+    # "HH:MM" -> minutes since midnight
+    hours, minutes = clock.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class AdaptiveRate:
+    # QPIGS interval of a device: min_interval as soon as a mapped value moved
+    # more than its threshold since the previous sample or a warning was
+    # raised, then, after `hold` steady samples, multiplied by `backoff` on
+    # every steady one up to max_interval. Between day.start and day.end
+    # (local time) the slowest is day.max_interval. The intervals are
+    # min_interval times a power of backoff, or a ceiling, so the interval tag
+    # of the points only takes a few values.
+    def __init__(self, conf):
+        self.min_interval = conf.get("min_interval", 0.25)
+        self.max_interval = conf.get("max_interval", 30)
+        self.backoff = conf.get("backoff", 2)
+        self.hold = conf.get("hold", 4)
+        self.thresholds = [
+            (key.split(".", 1)[0], key.split(".", 1)[1], threshold)
+            for key, threshold in conf.get("thresholds", DEFAULT_THRESHOLDS).items()
+        ]
+        day = conf.get("day")
+        self.day = None
+        if day is not None:
+            self.day = (
+                Minutes(day["start"]),
+                Minutes(day["end"]),
+                day.get("max_interval", self.max_interval),
+            )
+        self.interval = self.min_interval
+        self.steady = 0
+        self.last = {}
+
+    def Ceiling(self):
+        if self.day is None:
+            return self.max_interval
+        start, end, day_interval = self.day
+        now = time.localtime()
+        minutes = now.tm_hour * 60 + now.tm_min
+        if start <= minutes < end or (end < start and not end <= minutes < start):
+            return day_interval
+        return self.max_interval
+
+    def Changed(self, fields):
+        # fields: measurement -> fields of the sample
+        changed = False
+        for measurement, field, threshold in self.thresholds:
+            value = fields.get(measurement, {}).get(field)
+            if value is None:
+                continue
+            last = self.last.get((measurement, field))
+            self.last[(measurement, field)] = value
+            if last is not None and abs(value - last) >= threshold:
+                changed = True
+        return changed
+
+    def Alert(self):
+        self.interval = self.min_interval
+        self.steady = 0
+
+    def Observe(self, fields):
+        # the interval until the next sample
+        if self.Changed(fields):
+            self.Alert()
+            return self.interval
+        self.steady += 1
+        ceiling = self.Ceiling()
+        if self.steady > self.hold:
+            self.interval = self.interval * self.backoff
+        if self.interval > ceiling:
+            self.interval = ceiling
+        return self.interval
+
+    def Tag(self):
+        # value of the interval tag, "0.25", "1", "30"
+        return "{:g}".format(self.interval)
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import clock
+import contextlib
+import httpwriter
+import startup
+import syslog
+import time
+
+
+class AsyncInfluxWriter:
+    # minimal keep-alive http/1.1 client posting line protocol, the endpoint,
+    # headers, gzip and retries are the ones of httpwriter.InfluxHttpWriter
+    def __init__(self, conf):
+        self.conf = conf
+        self.endpoint = httpwriter.InfluxHttpWriter(conf)
+        self.host = conf["host"]
+        self.port = conf["port"]
+        self.ssl = conf.get("ssl", False) or None
+        self.reader = None
+        self.writer = None
+
+    async def Request(self, target, body, headers):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl),
+                self.endpoint.connect_timeout,
+            )
+        head = "POST {} HTTP/1.1\r\nHost: {}:{}\r\n".format(
+            target, self.host, self.port
+        )
+        head += "Content-Length: {}\r\n".format(len(body))
+        for name, value in headers.items():
+            head += "{}: {}\r\n".format(name, value)
+        self.writer.write((head + "\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        close = False
+        retry_after = None
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                close = True
+            elif name == "retry-after":
+                retry_after = value.strip()
+        content = await self.reader.readexactly(length) if length else b""
+        if close:
+            self.Close()
+        return status, content, retry_after
+
+    async def Post(self, target, body, headers):
+        try:
+            return await asyncio.wait_for(
+                self.Request(target, body, headers), self.endpoint.read_timeout
+            )
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            # drop the connection, the next request opens a fresh one
+            self.Close()
+            raise e
+
+    async def Write(self, data):
+        endpoint = self.endpoint
+        body = endpoint.Body(data)
+        created = False
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                status, content, retry_after = await self.Post(
+                    endpoint.target, body, endpoint.headers
+                )
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                error = e
+            else:
+                if status == 204:
+                    return
+                error = IOError("influx answered {}: {}".format(status, content[:200]))
+                if status == 404 and endpoint.version == 1 and not created:
+                    syslog.syslog(
+                        syslog.LOG_WARNING,
+                        "{} database not found, intempting to create now".format(
+                            endpoint.database
+                        ),
+                    )
+                    await self.Post(endpoint.CreateTarget(), b"", {})
+                    created = True
+                    continue
+                if status != 429 and status < 500:
+                    raise error
+            if attempt >= endpoint.retries:
+                raise error
+            if endpoint.stats is not None:
+                endpoint.stats.Count("influx_retries")
+            await asyncio.sleep(endpoint.Backoff(attempt, retry_after))
+            attempt += 1
+
+    def Close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+
+
+class AsyncRunner:
+    # polling, status polling and influx flushing run as separate tasks linked by
+    # a bounded queue, a slow influx or QPIRI never shifts the QPIGS cadence
+    def __init__(self, inverter):
+        self.inverter = inverter
+        self.spool = inverter.writer.spool
+        self.influx = None
+        # built by a reload, swapped in by WriteBatch before its next write
+        self.pending_influx = None
+        self.stats = inverter.stats
+        self.queue = None
+        self.dropped = 0
+        # set when a raised warning wants the next QPIGS of an adaptive device now
+        self.wakeups = {}
+        self.Configure()
+
+    def Configure(self):
+        # at startup and on the loop after every config reload
+        self.conf = self.inverter.conf
+        self.interval = (
+            self.conf.get("schedule", {})
+            .get("QPIGS", {})
+            .get("interval", self.conf["inverterPoller"].get("interval", 1))
+        )
+        self.batch_size = self.conf["influx"].get("batch_size", 500)
+        self.flush_interval = self.conf["influx"].get("flush_interval", 10)
+        self.max_buffer = self.conf["influx"].get("max_buffer", 10000)
+        influx = self.pending_influx or self.influx
+        if influx is None or influx.conf != self.conf["influx"]:
+            self.pending_influx = AsyncInfluxWriter(self.conf["influx"])
+            self.pending_influx.endpoint.stats = self.stats
+
+    def SwapInflux(self):
+        # between two writes only, a request in flight keeps its connection
+        if self.pending_influx is None:
+            return
+        if self.influx is not None:
+            self.influx.Close()
+        self.influx, self.pending_influx = self.pending_influx, None
+
+    @contextlib.asynccontextmanager
+    async def Locked(self):
+        # the reload thread holds the inverter lock while it swaps the mapping,
+        # filter and sinks: wait for it from an executor thread, not the loop
+        lock = self.inverter.lock
+        if not lock.acquire(blocking=False):
+            acquired = asyncio.get_running_loop().run_in_executor(None, lock.acquire)
+            try:
+                await asyncio.shield(acquired)
+            except asyncio.CancelledError:
+                acquired.add_done_callback(lambda future: lock.release())
+                raise
+        try:
+            yield
+        finally:
+            lock.release()
+
+    async def Send(self, unit, command):
+        # the device arbiter serializes the commands, wait for it off the loop
+        return await asyncio.get_running_loop().run_in_executor(
+            None, unit.PolInverter, command
+        )
+
+    def Offer(self, payload):
+        if self.inverter.change_filter is not None:
+            payload = self.inverter.change_filter.Filter(payload)
+            if not payload:
+                return
+        for sink in self.inverter.sinks:
+            sink.Add(payload)
+        # never block a poller, shed the oldest payload when influx lags behind
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            syslog.syslog(
+                syslog.LOG_WARNING,
+                "write queue full, dropped {} payloads".format(self.dropped),
+            )
+        self.queue.put_nowait(payload)
+
+    async def Tick(self, deadline, interval, wake=None):
+        # sleep until the next slot of a fixed grid, skipping the missed ones.
+        # A set wake event ends the sleep early, the grid restarts from there.
+        loop = asyncio.get_running_loop()
+        deadline += interval
+        if deadline < loop.time():
+            deadline += (loop.time() - deadline) // interval * interval + interval
+        if wake is None:
+            await asyncio.sleep(deadline - loop.time())
+            return deadline
+        try:
+            await asyncio.wait_for(wake.wait(), deadline - loop.time())
+        except asyncio.TimeoutError:
+            return deadline
+        wake.clear()
+        return loop.time()
+
+    async def PollData(self, unit):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            if self.stats is not None:
+                self.stats.Record("jitter_QPIGS", loop.time() - deadline)
+            try:
+                rawData = await self.Send(unit, "QPIGS")
+                startup.STARTUP.Mark("first_sample")
+                # a config reload swaps the mapping, filter and sinks under it
+                async with self.Locked():
+                    start = time.monotonic()
+                    points = self.inverter.Aggregate(
+                        self.inverter.MapSample(unit, rawData, unit.Stamp("QPIGS"))
+                    )
+                    if self.stats is not None:
+                        self.stats.Record("map_data", time.monotonic() - start)
+                    self.Offer(points)
+                unit.failCount = 0
+            except Exception as e:
+                syslog.syslog(
+                    syslog.LOG_ERR,
+                    "Failed to poll data from inverter {}: {}".format(unit.id, e),
+                )
+                unit.failCount += 1
+                if unit.failCount % 10 > 8:
+                    syslog.syslog(
+                        syslog.LOG_ERR,
+                        "Inverter {} polling failed in a {} time in a raw".format(
+                            unit.id, unit.failCount
+                        ),
+                    )
+            if unit.adaptive is None:
+                deadline = await self.Tick(deadline, self.interval)
+            else:
+                deadline = await self.Tick(
+                    deadline, unit.adaptive.interval, self.wakeups[unit]
+                )
+
+    async def PollStatus(self, unit):
+        loop = asyncio.get_running_loop()
+        # half a period behind the data, the first QPIGS is not queued behind
+        # the warnings and configuration probes
+        deadline = loop.time() + self.interval / 2
+        await asyncio.sleep(self.interval / 2)
+        conf_deadline = loop.time()
+        status_deadline = loop.time()
+        confSent = False
+        while True:
+            try:
+                rawWarn = await self.Send(unit, "QPIWS")
+                when = unit.Stamp("QPIWS")
+                async with self.Locked():
+                    previous = unit.warning_mask
+                    payload = self.inverter.MapWarningChanges(unit, rawWarn, when)
+                    if unit.adaptive is not None and (
+                        unit.warning_mask & ~(previous or 0)
+                    ):
+                        # a warning was raised, sample the transient right away
+                        unit.adaptive.Alert()
+                        self.wakeups[unit].set()
+                    if not payload and loop.time() >= status_deadline:
+                        payload = self.inverter.MapWarning(rawWarn, when, unit.id)
+                    if payload:
+                        status_deadline = loop.time() + 30 * 60
+                        self.Offer(payload)
+            except Exception as e:
+                syslog.syslog(
+                    syslog.LOG_ERR,
+                    "Failed to poll warnings from inverter {}: {}".format(unit.id, e),
+                )
+
+            # a due read first, so a tick of the grid serves it as well
+            if unit.ConfDue() or loop.time() >= conf_deadline:
+                unit.conf_due = False
+                conf_deadline = loop.time() + 45 * 60
+                try:
+                    rawConf = await self.Send(unit, "QPIRI")
+                    rawConf, payload = await loop.run_in_executor(
+                        None, self.inverter.ApplyInverterConf, unit, rawConf
+                    )
+                    unit.ConfApplied()
+                    async with self.Locked():
+                        if rawConf != unit.inverter_current_conf or not confSent:
+                            unit.inverter_current_conf = rawConf
+                            payload += self.inverter.MapConfig(
+                                rawConf, unit.Stamp("QPIRI"), unit.id
+                            )
+                        confSent = True
+                        if payload:
+                            self.Offer(payload)
+                except Exception as e:
+                    # tried again after a backoff, see Device.ConfFailed
+                    unit.ConfFailed()
+                    syslog.syslog(
+                        syslog.LOG_ERR,
+                        "Failed to poll config from inverter {}: {}".format(unit.id, e),
+                    )
+            deadline = await self.Tick(deadline, self.interval)
+
+    async def Flush(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        deadline = None
+        failed = False
+        # the first points are written as soon as they come in
+        first = True
+        while True:
+            timeout = None if deadline is None else max(0, deadline - loop.time())
+            try:
+                payload = await asyncio.wait_for(self.queue.get(), timeout)
+                if deadline is None:
+                    deadline = loop.time() + (0 if first else self.flush_interval)
+                    first = False
+                batch.extend(payload)
+                if failed or len(batch) < self.batch_size:
+                    continue
+            except asyncio.TimeoutError:
+                pass
+            failed = not await self.WriteBatch(batch)
+            if failed:
+                # keep the failed points for the next interval, newest ones first
+                batch = batch[-self.max_buffer :]
+                deadline = loop.time() + self.flush_interval
+            else:
+                batch = []
+                deadline = None
+
+    async def WriteBatch(self, batch):
+        loop = asyncio.get_running_loop()
+        self.SwapInflux()
+        data = self.inverter.EncodePoints(batch)
+        # the spool fsyncs and reads its segments, off the loop
+        if self.spool is not None and not self.spool.Empty():
+            await loop.run_in_executor(None, self.spool.Append, data)
+            await self.Replay()
+            return True
+        start = time.monotonic()
+        try:
+            await self.influx.Write(data)
+        except Exception as e:
+            if self.stats is not None:
+                self.stats.Record("influx_write", time.monotonic() - start, True)
+            syslog.syslog(
+                syslog.LOG_ERR,
+                "Failed to write {} points: {}".format(len(batch), e),
+            )
+            if self.spool is None:
+                return False
+            await loop.run_in_executor(None, self.spool.Append, data)
+            return True
+        if self.stats is not None:
+            self.stats.Record("influx_write", time.monotonic() - start)
+        if startup.STARTUP.Mark("first_write"):
+            self.inverter.ReportStartup()
+        return True
+
+    async def ReportStats(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            deadline = await self.Tick(deadline, self.stats.interval)
+            self.stats.Set("queued_payloads", self.queue.qsize())
+            self.stats.Set("dropped_payloads", self.dropped)
+            async with self.Locked():
+                self.Offer(self.stats.Points(clock.Now()))
+
+    async def Replay(self):
+        loop = asyncio.get_running_loop()
+        chunks = self.spool.Replay()
+        size = 0
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                await self.influx.Write(chunk)
+                size += len(chunk)
+        except Exception as e:
+            syslog.syslog(
+                syslog.LOG_WARNING,
+                "Spool replay stopped after {} bytes: {}".format(size, e),
+            )
+
+    async def Run(self):
+        syslog.syslog(syslog.LOG_INFO, "influx-writer started (asyncio)")
+        loop = asyncio.get_running_loop()
+        self.inverter.reload_hooks.append(
+            lambda: loop.call_soon_threadsafe(self.Configure)
+        )
+        self.queue = asyncio.Queue(self.conf["influx"].get("queue_size", 100))
+        self.wakeups = {unit: asyncio.Event() for unit in self.inverter.devices}
+        tasks = [self.Flush()]
+        if self.stats is not None:
+            tasks.append(self.ReportStats())
+        for unit in self.inverter.devices:
+            tasks += [self.PollData(unit), self.PollStatus(unit)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.SwapInflux()
+            self.influx.Close()
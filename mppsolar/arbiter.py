@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import syslog
+import threading
+import time
+
+# lower runs first: live data, then warnings, then configuration reads and
+# setting commands
+PRIORITIES = {"QPIGS": 0, "QPIWS": 1}
+DEFAULT_PRIORITY = 2
+
+
+class Request:
+    def __init__(self, command, priority, deadline):
+        self.command = command
+        self.priority = priority
+        self.deadline = deadline
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self.waiters = 1
+
+
+class Arbiter:
+    # the only way to the device: a single worker thread sends one command at
+    # a time, highest priority first, so polls of several threads and setting
+    # commands never interleave on the wire. A command already waiting in the
+    # queue is not queued twice, the callers share its answer. Every command
+    # has a deadline covering its wait in the queue and its exchange.
+    def __init__(self, link, conf):
+        self.link = link
+        self.priorities = dict(PRIORITIES, **conf.get("priorities", {}))
+        self.timeout = conf.get("command_timeout", 10)
+        self.timeouts = conf.get("command_timeouts", {})
+        self.queue = []
+        self.pending = {}
+        self.order = itertools.count()
+        self.closed = False
+        self.stats = None
+        self.cond = threading.Condition()
+        self.counters = {
+            "sent": 0,
+            "errors": 0,
+            "coalesced": 0,
+            "timeouts": 0,
+            "expired": 0,
+            "max_queue": 0,
+            "busy": 0.0,
+        }
+        self.thread = threading.Thread(target=self.Loop, name="arbiter", daemon=True)
+        self.thread.start()
+
+    def Send(self, command, priority=None):
+        timeout = self.timeouts.get(command, self.timeout)
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("device arbiter closed")
+            request = self.pending.get(command)
+            if request is not None:
+                request.waiters += 1
+                request.deadline = max(request.deadline, time.monotonic() + timeout)
+                self.counters["coalesced"] += 1
+            else:
+                if priority is None:
+                    priority = self.priorities.get(command, DEFAULT_PRIORITY)
+                request = Request(command, priority, time.monotonic() + timeout)
+                self.pending[command] = request
+                heapq.heappush(self.queue, (priority, next(self.order), request))
+                self.counters["max_queue"] = max(
+                    self.counters["max_queue"], len(self.queue)
+                )
+                self.cond.notify()
+        if not request.done.wait(timeout):
+            with self.cond:
+                self.counters["timeouts"] += 1
+                request.waiters -= 1
+            raise TimeoutError("{} got no answer within {}s".format(command, timeout))
+        if request.error is not None:
+            raise request.error
+        return request.response
+
+    def Loop(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed and not self.queue:
+                    return
+                priority, order, request = heapq.heappop(self.queue)
+                # later callers get a fresh request, not this answer
+                del self.pending[request.command]
+                if request.waiters <= 0 or time.monotonic() > request.deadline:
+                    # every caller gave up meanwhile, do not bother the device
+                    self.counters["expired"] += 1
+                    request.error = TimeoutError("expired in queue")
+                    request.done.set()
+                    continue
+            start = time.monotonic()
+            try:
+                request.response = self.link.Send(request.command)
+            except Exception as e:
+                request.error = e
+            busy = time.monotonic() - start
+            if self.stats is not None:
+                self.stats.Record(
+                    "exchange_{}".format(request.command),
+                    busy,
+                    request.error is not None,
+                )
+            with self.cond:
+                self.counters["sent"] += 1
+                self.counters["busy"] += busy
+                if request.error is not None:
+                    self.counters["errors"] += 1
+            request.done.set()
+
+    def Stats(self):
+        with self.cond:
+            return dict(self.counters, queued=len(self.queue))
+
+    def LogStats(self, name):
+        stats = self.Stats()
+        syslog.syslog(
+            syslog.LOG_INFO,
+            "{} commands sent={} errors={} coalesced={} timeouts={} expired={} "
+            "max_queue={} busy={:.1f}s".format(
+                name,
+                stats["sent"],
+                stats["errors"],
+                stats["coalesced"],
+                stats["timeouts"],
+                stats["expired"],
+                stats["max_queue"],
+                stats["busy"],
+            ),
+        )
+
+    def Close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(self.timeout)
+        self.link.Close()
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import concurrent.futures
+import datetime
+import gzip
+import json
+import multiprocessing
+import operator
+import os
+import queue
+import sys
+import time
+import httpwriter
+import lineprotocol
+import mapping
+import warningmask
+
+# command of a mppsolar capture -> kind of mapping it goes through
+COMMANDS = {"QPIGS": "data", "QPIRI": "config", "QPIWS": "warning"}
+
+# a key only found in one kind of capture, when the command is not recorded
+PROBES = (
+    ("Warnings", "poller"),
+    ("battery_type", "config"),
+    ("pv_input_power", "data"),
+    ("inverter_fault", "warning"),
+    ("warning_mask", "warning"),
+)
+
+# inverter_poller -1 output key -> QPIGS key of mppsolar, its Warnings bit
+# string is mapped as a QPIWS answer
+POLLER_KEYS = {
+    "Battery_voltage": "battery_voltage",
+    "SCC_voltage": "battery_voltage_from_scc",
+    "Battery_charge_current": "battery_charging_current",
+    "Battery_discharge_current": "battery_discharge_current",
+    "Battery_capacity": "battery_capacity",
+    "PV_in_voltage": "pv_input_voltage",
+    "PV_in_current": "pv_input_current_for_battery",
+    "PV_in_watts": "pv_input_power",
+    "AC_grid_voltage": "ac_input_voltage",
+    "AC_grid_frequency": "ac_input_frequency",
+    "AC_out_voltage": "ac_output_voltage",
+    "AC_out_frequency": "ac_output_frequency",
+    "Load_watt": "ac_output_active_power",
+    "Load_pct": "ac_output_load",
+    "Load_va": "ac_output_apparent_power",
+    "Bus_voltage": "bus_voltage",
+    "Heatsink_temperature": "inverter_heat_sink_temperature",
+    "Load_status_on": "is_load_on",
+    "SCC_charge_on": "is_scc_charging_on",
+    "AC_charge_on": "is_ac_charging_on",
+}
+
+# keys a capture can carry its own time in
+TIME_KEYS = ("time", "timestamp", "_time")
+
+
+class Capture(dict):
+    # keys older captures lack map to None, which the encoder leaves out
+    def __missing__(self, key):
+        return None
+
+
+def Stamp(value):
+    # utc ns of an epoch in s, ms, us or ns, or of an ISO 8601 date, naive
+    # dates are local time like the ones `date` prints
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    elif isinstance(value, str) and value.replace(".", "", 1).isdigit():
+        value = float(value)
+    if isinstance(value, (int, float)):
+        for limit, scale in ((1e11, 1000000000), (1e14, 1000000), (1e17, 1000)):
+            if value < limit:
+                return int(value * scale)
+        return int(value)
+    date = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return int(date.timestamp()) * 1000000000 + date.microsecond * 1000
+
+
+def Paths(paths):
+    # the files given and the ones below the directories given, in name order
+    for path in paths:
+        if not os.path.isdir(path):
+            yield os.path.abspath(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                yield os.path.abspath(os.path.join(root, name))
+
+
+def Open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def Parse(line):
+    # a json object with a time key, or one behind a stamp (`date -Is` or
+    # `date +%s` output), the stamp is None when there is neither
+    if line[0] == "{":
+        capture = Capture(json.loads(line))
+        when = next((capture[key] for key in TIME_KEYS if key in capture), None)
+    else:
+        when, _, line = line.partition(" ")
+        capture = Capture(json.loads(line))
+    return (None if when is None else Stamp(when)), capture
+
+
+def Captures(path, skip=0):
+    # (lines read, utc ns, capture) of a file, (lines read, None, None) for a
+    # line that does not parse. One capture per line, or a single json
+    # document, e.g. one `mppsolar -o json` output per file, stamped with the
+    # modification time of the file when it has no time key.
+    with Open(path) as lines:
+        first = lines.readline()
+        second = lines.readline()
+        if first.startswith("{") and (first.strip() == "{" or not second.strip()):
+            if skip:
+                return
+            try:
+                when, capture = Parse(" ".join((first + second + lines.read()).split()))
+            except ValueError:
+                yield 1, None, None
+                return
+            if when is None:
+                when = int(os.stat(path).st_mtime * 1e9)
+            yield 1, when, capture
+            return
+        lines.seek(0)
+        for number, line in enumerate(lines, 1):
+            if number <= skip:
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                when, capture = Parse(line)
+            except ValueError:
+                yield number, None, None
+                continue
+            yield number, when, capture
+
+
+def Kind(capture):
+    kind = COMMANDS.get(capture.get("_command"))
+    if kind is not None:
+        return kind
+    for key, kind in PROBES:
+        if key in capture:
+            return kind
+    return None
+
+
+class Importer:
+    # one per pool process: the mappers of the config, an encoder and a keep
+    # alive connection to influx. A file is mapped like the writer maps live
+    # answers, its points are written in batches sorted by time.
+    def __init__(self, conf, progress, batch_size, device_id):
+        self.mappers = mapping.NewMappers(conf.get("mapping", {}))
+        self.encoder = lineprotocol.LineEncoder(conf["influx"].get("precision", "ns"))
+        self.influx = httpwriter.InfluxHttpWriter(conf["influx"])
+        self.progress = progress
+        self.batch_size = batch_size
+        self.tags = (("id", device_id),)
+
+    def Warning(self, state, mask, fields, when):
+        # events and a warning point when the mask changed, as the writer does
+        previous = state.get("warning")
+        state["warning"] = mask
+        if mask == previous:
+            return []
+        return warningmask.Events(previous or 0, mask, self.tags, when) + self.mappers[
+            "warning"
+        ].Map(fields, when, self.tags)
+
+    def Map(self, state, kind, capture, when):
+        if kind == "data":
+            return self.mappers["data"].Map(capture, when, self.tags)
+        if kind == "warning":
+            mask = warningmask.FromResponse(capture)
+            return self.Warning(state, mask, warningmask.ToFields(mask), when)
+        if kind == "config":
+            # written when it changed only, like the writer does
+            points = self.mappers["config"].Map(capture, when, self.tags)
+            fields = [point[2] for point in points]
+            if fields == state.get("config"):
+                return []
+            state["config"] = fields
+            return points
+        data = Capture(
+            (key, capture[poller_key]) for poller_key, key in POLLER_KEYS.items()
+        )
+        mask = warningmask.Parse(capture["Warnings"] or "")
+        # ints like the live QPIWS fields, influx refuses a type change
+        return self.mappers["data"].Map(data, when, self.tags) + self.Warning(
+            state, mask, warningmask.ToFields(mask), when
+        )
+
+    def Write(self, points):
+        points.sort(key=operator.itemgetter(3))
+        self.influx.Write(self.encoder.Encode(points))
+
+    def Import(self, path, skip):
+        # returns the lines read and what is left of the counters, the rest
+        # was reported after every batch written
+        state = {}
+        points = []
+        counts = {"samples": 0, "points": 0, "skipped": 0}
+        lines = skip
+        for lines, when, capture in Captures(path, skip):
+            kind = None if capture is None else Kind(capture)
+            if kind is None or when is None:
+                counts["skipped"] += 1
+                continue
+            try:
+                points += self.Map(state, kind, capture, when)
+            except (KeyError, TypeError, ValueError):
+                counts["skipped"] += 1
+                continue
+            counts["samples"] += 1
+            if len(points) >= self.batch_size:
+                self.Write(points)
+                counts["points"] += len(points)
+                self.progress.put((path, lines, counts))
+                points = []
+                counts = {"samples": 0, "points": 0, "skipped": 0}
+        if points:
+            self.Write(points)
+            counts["points"] += len(points)
+        return lines, counts
+
+
+IMPORTER = None
+
+
+def Start(conf, progress, batch_size, device_id):
+    global IMPORTER
+    IMPORTER = Importer(conf, progress, batch_size, device_id)
+
+
+def ImportFile(path, skip):
+    return IMPORTER.Import(path, skip)
+
+
+class Checkpoint:
+    # path -> {"lines": ..., "size": ..., "done": ...} of every file started,
+    # rewritten atomically so a killed import resumes after its last batch
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as checkpoint:
+                self.files = json.load(checkpoint)
+
+    def Skip(self, path):
+        # lines already written of a file, None when it is done
+        entry = self.files.get(path)
+        if entry is None:
+            return 0
+        if os.path.getsize(path) < entry["size"]:
+            print("{} shrank since the checkpoint, importing it again".format(path))
+            return 0
+        return None if entry["done"] else entry["lines"]
+
+    def Update(self, path, lines, done=False):
+        entry = self.files.get(path)
+        if entry is not None and entry["done"]:
+            return
+        self.files[path] = {
+            "lines": lines,
+            "size": os.path.getsize(path),
+            "done": done,
+        }
+
+    def Save(self):
+        if self.path is None:
+            return
+        with open(self.path + ".tmp", "w") as checkpoint:
+            json.dump(self.files, checkpoint)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class Totals:
+    def __init__(self, files):
+        self.files = files
+        self.done = 0
+        self.counts = {"samples": 0, "points": 0, "skipped": 0}
+        self.start = time.monotonic()
+
+    def Add(self, counts):
+        for key, value in counts.items():
+            self.counts[key] += value
+
+    def Report(self, label):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        print(
+            "{:<8} files={}/{} samples={} points={} skipped={} "
+            "samples/s={:.0f} points/s={:.0f}".format(
+                label,
+                self.done,
+                self.files,
+                self.counts["samples"],
+                self.counts["points"],
+                self.counts["skipped"],
+                self.counts["samples"] / elapsed,
+                self.counts["points"] / elapsed,
+            ),
+            flush=True,
+        )
+
+
+def Run(args):
+    with open(args.conf, "r") as jsonfile:
+        conf = json.load(jsonfile)
+    checkpoint = Checkpoint(args.checkpoint)
+    todo = []
+    for path in Paths(args.paths):
+        skip = checkpoint.Skip(path)
+        if skip is not None:
+            todo.append((path, skip))
+    totals = Totals(len(todo))
+    progress = multiprocessing.Queue()
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(
+        args.workers,
+        initializer=Start,
+        initargs=(conf, progress, args.batch_size, args.id),
+    ) as pool:
+        futures = {pool.submit(ImportFile, path, skip): path for path, skip in todo}
+        pending = set(futures)
+        last = time.monotonic()
+        while pending:
+            try:
+                path, lines, counts = progress.get(timeout=0.2)
+                checkpoint.Update(path, lines)
+                totals.Add(counts)
+            except queue.Empty:
+                pass
+            finished = [future for future in pending if future.done()]
+            for future in finished:
+                pending.remove(future)
+                path = futures[future]
+                totals.done += 1
+                try:
+                    lines, counts = future.result()
+                except Exception as e:
+                    print("{} failed, kept for the next run: {}".format(path, e))
+                    failed += 1
+                    continue
+                checkpoint.Update(path, lines, done=True)
+                totals.Add(counts)
+            if finished or time.monotonic() - last >= args.report:
+                checkpoint.Save()
+            if time.monotonic() - last >= args.report:
+                last = time.monotonic()
+                totals.Report("{:.0f}s".format(last - totals.start))
+    # progress still in the queue when the last file finished
+    while True:
+        try:
+            path, lines, counts = progress.get_nowait()
+        except queue.Empty:
+            break
+        checkpoint.Update(path, lines)
+        totals.Add(counts)
+    checkpoint.Save()
+    totals.Report("total")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="write recorded inverter captures to influx"
+    )
+    parser.add_argument("-c", "--conf", required=True, help="path to a config file")
+    parser.add_argument(
+        "paths", nargs="+", help="capture files, or directories to import all of"
+    )
+    parser.add_argument(
+        "--checkpoint", help="file recording the progress, to resume an import"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="files imported at once"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=5000, help="points per influx write"
+    )
+    parser.add_argument(
+        "--id", type=int, default=1, help="device id the points are tagged with"
+    )
+    parser.add_argument(
+        "--report", type=float, default=10, help="seconds between reports"
+    )
+    args = parser.parse_args()
+    sys.exit(Run(args))
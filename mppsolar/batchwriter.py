@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import syslog
+import threading
+import time
+
+
+class BatchWriter:
+    # buffer points in memory and hand them to `write` from a background thread,
+    # either once batch_size points are waiting or once the oldest one is
+    # flush_interval seconds old, so the sampling loop never waits on influx.
+    # With a spool, batches influx refused are kept on disk and replayed first.
+    def __init__(self, encode, write, conf, spool=None):
+        self.encode = encode
+        self.write = write
+        self.spool = spool
+        self.batch_size = conf.get("batch_size", 500)
+        self.flush_interval = conf.get("flush_interval", 10)
+        self.buffer = collections.deque(maxlen=conf.get("max_buffer", 10000))
+        self.oldest = None
+        # the first points are written as soon as they come in, a fresh start
+        # shows up in influx after one sample instead of one flush_interval
+        self.started = False
+        # after a failed write nothing is tried again before this time, even
+        # with a full batch waiting
+        self.retry_at = None
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(
+            target=self.Loop, name="influx-flush", daemon=True
+        )
+        self.thread.start()
+
+    def Add(self, points):
+        with self.cond:
+            overflow = len(self.buffer) + len(points) - self.buffer.maxlen
+            if overflow > 0:
+                # the deque drops the oldest points by itself, just account for it
+                self.dropped += overflow
+                syslog.syslog(
+                    syslog.LOG_WARNING,
+                    "write buffer full, dropped {} points".format(self.dropped),
+                )
+            first = not self.buffer
+            if first:
+                self.oldest = time.monotonic()
+            self.buffer.extend(points)
+            # the flush thread waits without timeout on an empty buffer, the
+            # first points must start its flush_interval countdown
+            if first or len(self.buffer) >= self.batch_size:
+                self.cond.notify()
+
+    def Take(self):
+        self.started = True
+        batch = []
+        while self.buffer and len(batch) < self.batch_size:
+            batch.append(self.buffer.popleft())
+        self.oldest = time.monotonic() if self.buffer else None
+        return batch
+
+    def Giveback(self, batch):
+        # put a failed batch back in front of the newer points, the oldest points
+        # are the ones lost if that overflows the buffer
+        room = self.buffer.maxlen - len(self.buffer)
+        if room < len(batch):
+            self.dropped += len(batch) - room
+            batch = batch[len(batch) - room :]
+        self.buffer.extendleft(reversed(batch))
+        if self.oldest is None and self.buffer:
+            self.oldest = time.monotonic()
+
+    def Due(self):
+        if self.retry_at is not None and time.monotonic() < self.retry_at:
+            return False
+        if len(self.buffer) >= self.batch_size or (self.buffer and not self.started):
+            return True
+        return (
+            self.oldest is not None
+            and time.monotonic() - self.oldest >= self.flush_interval
+        )
+
+    def Wait(self):
+        # seconds until the buffer may be due, None to wait for points
+        if self.retry_at is not None and time.monotonic() < self.retry_at:
+            return self.retry_at - time.monotonic()
+        if self.oldest is None:
+            return None
+        return self.flush_interval - (time.monotonic() - self.oldest)
+
+    def Loop(self):
+        while True:
+            with self.cond:
+                while not self.closed and not self.Due():
+                    self.cond.wait(self.Wait())
+                if self.closed and not self.buffer:
+                    return
+                closing = self.closed
+                batch = self.Take()
+            if closing and self.spool is None:
+                # last attempt on the way out, nothing to give the batch back to
+                try:
+                    self.write(self.encode(batch))
+                except Exception as e:
+                    syslog.syslog(
+                        syslog.LOG_ERR,
+                        "Failed to write {} points on close: {}".format(len(batch), e),
+                    )
+                continue
+            if self.spool is None:
+                self.WriteBatch(batch)
+            else:
+                self.SpoolBatch(batch)
+
+    def WriteBatch(self, batch):
+        try:
+            self.write(self.encode(batch))
+        except Exception as e:
+            syslog.syslog(
+                syslog.LOG_ERR,
+                "Failed to write {} points: {}".format(len(batch), e),
+            )
+            with self.cond:
+                self.Giveback(batch)
+                # wait for the next interval instead of hammering influx
+                self.oldest = time.monotonic()
+                self.retry_at = self.oldest + self.flush_interval
+            return
+        self.retry_at = None
+
+    def SpoolBatch(self, batch):
+        data = self.encode(batch)
+        if self.spool.Empty():
+            try:
+                self.write(data)
+                return
+            except Exception as e:
+                syslog.syslog(
+                    syslog.LOG_ERR,
+                    "Failed to write {} points, spooling them: {}".format(
+                        len(batch), e
+                    ),
+                )
+                self.spool.Append(data)
+                return
+        # older points are waiting on disk, queue behind them to keep the order
+        self.spool.Append(data)
+        self.Replay()
+
+    def Replay(self):
+        size = 0
+        start = time.monotonic()
+        try:
+            for chunk in self.spool.Replay():
+                self.write(chunk)
+                size += len(chunk)
+        except Exception as e:
+            syslog.syslog(
+                syslog.LOG_WARNING,
+                "Spool replay stopped after {} bytes: {}".format(size, e),
+            )
+            return
+        syslog.syslog(
+            syslog.LOG_INFO,
+            "Replayed {} spooled bytes in {:.1f}s".format(
+                size, time.monotonic() - start
+            ),
+        )
+
+    def Configure(self, conf, write=None):
+        # a config reload: the buffered points are kept, only dropped when the
+        # buffer shrinks under them
+        with self.cond:
+            if write is not None:
+                self.write = write
+            self.batch_size = conf.get("batch_size", 500)
+            self.flush_interval = conf.get("flush_interval", 10)
+            max_buffer = conf.get("max_buffer", 10000)
+            if max_buffer != self.buffer.maxlen:
+                self.dropped += max(0, len(self.buffer) - max_buffer)
+                self.buffer = collections.deque(self.buffer, maxlen=max_buffer)
+            self.cond.notify()
+
+    def Flush(self):
+        with self.cond:
+            self.retry_at = None
+            self.oldest = time.monotonic() - self.flush_interval
+            self.cond.notify()
+
+    def Close(self, timeout=None):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+        if self.spool is not None:
+            self.spool.Close()
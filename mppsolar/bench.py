@@ -0,0 +1,738 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import gzip
+import http.client
+import http.server
+import importlib.util
+import json
+import os
+import resource
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import lineprotocol
+import mapping
+import pi30
+import sinks
+import snapshot
+import spool
+import transport
+import warningmask
+
+STUB_POLLER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "poller-child.py"
+)
+WRITER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "influx-writer.py")
+
+
+def Percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def Report(name, samples):
+    print(
+        "{:<12} n={:<6} mean={:8.3f}ms p50={:8.3f}ms p95={:8.3f}ms max={:8.3f}ms".format(
+            name,
+            len(samples),
+            sum(samples) / len(samples) * 1000,
+            Percentile(samples, 50) * 1000,
+            Percentile(samples, 95) * 1000,
+            max(samples) * 1000,
+        )
+    )
+
+
+def BenchTransport(args):
+    if args.conf:
+        with open(args.conf, "r") as jsonfile:
+            conf = json.load(jsonfile)["inverterPoller"]
+    else:
+        conf = {"transport": "fake", "latency": args.latency}
+    link = transport.NewTransport(conf)
+    for command in args.commands:
+        samples = []
+        for i in range(args.count):
+            start = time.perf_counter()
+            link.Send(command)
+            samples.append(time.perf_counter() - start)
+        Report(command, samples)
+    link.Close()
+
+
+def BenchChild(args):
+    # the same stub poller, spawned for every sample or kept running
+    stub = [sys.executable, STUB_POLLER, "--transport", "fake"]
+    samples = []
+    for i in range(args.count):
+        start = time.perf_counter()
+        json.loads(subprocess.check_output(stub + ["-c", "QPIGS"]).decode("utf-8"))
+        samples.append(time.perf_counter() - start)
+    Report("spawn", samples)
+
+    link = transport.ChildTransport({"child": stub})
+    link.Send("QPIGS")
+    samples = []
+    for i in range(args.count):
+        start = time.perf_counter()
+        link.Send("QPIGS")
+        samples.append(time.perf_counter() - start)
+    link.Close()
+    Report("child", samples)
+
+
+class FakeInfluxHandler(http.server.BaseHTTPRequestHandler):
+    # accept every write like influx would, counting what it receives. When
+    # tracking, every QPIGS sample (its battery line) is timed from the tick it
+    # is stamped with to its arrival here.
+    protocol_version = "HTTP/1.1"
+    received = 0
+    track = False
+    points = 0
+    samples = 0
+    latencies = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        size = int(self.headers["Content-Length"])
+        body = self.rfile.read(size)
+        FakeInfluxHandler.received += len(body)
+        if FakeInfluxHandler.track:
+            self.Track(body)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def Track(self, body):
+        arrival = time.time_ns()
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        lines = body.splitlines()
+        latencies = [
+            (arrival - int(line.rsplit(b" ", 1)[1])) / 1e9
+            for line in lines
+            if line.startswith(b"battery,")
+        ]
+        with FakeInfluxHandler.lock:
+            FakeInfluxHandler.points += len(lines)
+            FakeInfluxHandler.samples += len(latencies)
+            FakeInfluxHandler.latencies += latencies
+
+    def log_message(self, format, *args):
+        pass
+
+
+def FakeInflux():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeInfluxHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeBrokerHandler(socketserver.BaseRequestHandler):
+    # mqtt broker stand-in: acknowledges the CONNECT and counts the PUBLISH
+    # packets, sleeping delay seconds on each to play a slow broker
+    published = 0
+    delay = 0
+    handling = 0
+
+    def ReadPacket(self, stream):
+        header = stream.read(1)
+        if not header:
+            return None, None
+        length = 0
+        shift = 0
+        while True:
+            byte = stream.read(1)[0]
+            length += (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return header[0], stream.read(length)
+
+    def handle(self):
+        FakeBrokerHandler.handling += 1
+        try:
+            self.Serve()
+        finally:
+            FakeBrokerHandler.handling -= 1
+
+    def Serve(self):
+        stream = self.request.makefile("rb")
+        while True:
+            kind, body = self.ReadPacket(stream)
+            if kind is None or kind == 0xE0:
+                return
+            if kind == 0x10:
+                self.request.sendall(b"\x20\x02\x00\x00")
+            elif kind == 0xC0:
+                self.request.sendall(b"\xd0\x00")
+            elif kind & 0xF0 == 0x30:
+                FakeBrokerHandler.published += 1
+                if FakeBrokerHandler.delay:
+                    time.sleep(FakeBrokerHandler.delay)
+
+
+def FakeBroker():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeBrokerHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def LiteralMapData(data, date):
+    # the hand written mapping mapping.DEFAULT_MAPPING replaced, kept for comparison
+    payload = [
+        {
+            "measurement": "battery",
+            "tags": {"id": 1},
+            "time": date,
+            "fields": {
+                "DC_V": data["battery_voltage"],
+                "DC_V_scc": data["battery_voltage_from_scc"],
+                "charging_current": data["battery_charging_current"],
+                "discharge_current": data["battery_discharge_current"],
+                "soc": data["battery_capacity"],
+                "battery_voltage_to_steady_while_charging": data[
+                    "is_battery_voltage_to_steady_while_charging"
+                ],
+            },
+        },
+        {
+            "measurement": "pv",
+            "tags": {"id": 1},
+            "time": date,
+            "fields": {
+                "DC_V": data["pv_input_voltage"],
+                "A": data["pv_input_current_for_battery"],
+                "W": data["pv_input_power"],
+            },
+        },
+        {
+            "measurement": "grid",
+            "tags": {"id": 1},
+            "time": date,
+            "fields": {
+                "AC_V": data["ac_input_voltage"],
+                "Hz": data["ac_input_frequency"],
+            },
+        },
+        {
+            "measurement": "out",
+            "tags": {"id": 1},
+            "time": date,
+            "fields": {
+                "AC_V": data["ac_output_voltage"],
+                "Hz": data["ac_output_frequency"],
+                "load_watt": data["ac_output_active_power"],
+                "load_percent": data["ac_output_load"],
+                "load_va": data["ac_output_apparent_power"],
+            },
+        },
+        {
+            "measurement": "inverter",
+            "tags": {"id": 1},
+            "time": date,
+            "fields": {
+                "bus_voltage": data["bus_voltage"],
+                "heat_sink_temperature": data["inverter_heat_sink_temperature"],
+                "load_status_on": data["is_load_on"],
+                "scc_charge_on": data["is_scc_charging_on"],
+                "ac_charge_on": data["is_ac_charging_on"],
+                "charging_on": data["is_charging_on"],
+                "charging_to_float": data["is_charging_to_float"],
+                "configuration_changed": data["is_configuration_changed"],
+                "switched_on": data["is_switched_on"],
+            },
+        },
+    ]
+    return payload
+
+
+def BenchMapping(args):
+    data = transport.FAKE_RESPONSES["QPIGS"]
+    date = "2024-01-01T00:00:00Z"
+    start = time.perf_counter()
+    for i in range(args.count):
+        LiteralMapData(data, date)
+    elapsed = time.perf_counter() - start
+    print("literal      {:.2f}us per sample".format(elapsed / args.count * 1e6))
+
+    mapper = mapping.NewMappers({})["data"]
+    tags = {"id": 1}
+    start = time.perf_counter()
+    for i in range(args.count):
+        mapper.Map(data, date, tags)
+    elapsed = time.perf_counter() - start
+    print("compiled     {:.2f}us per sample".format(elapsed / args.count * 1e6))
+
+
+def BenchEncode(args):
+    data = transport.FAKE_RESPONSES["QPIGS"]
+    try:
+        from influxdb.line_protocol import make_lines
+
+        start = time.perf_counter()
+        payload = []
+        for i in range(args.count):
+            payload += LiteralMapData(data, "2024-01-01T00:00:00Z")
+        make_lines({"points": payload}).encode("utf-8")
+        elapsed = time.perf_counter() - start
+        print("make_lines   {:.2f}us per sample".format(elapsed / args.count * 1e6))
+    except ImportError:
+        print("make_lines   skipped, the influxdb package is not installed")
+
+    mapper = mapping.NewMappers({})["data"]
+    encoder = lineprotocol.LineEncoder()
+    tags = (("id", 1),)
+    start = time.perf_counter()
+    points = []
+    for i in range(args.count):
+        points += mapper.Map(data, time.time_ns(), tags)
+    encoder.Encode(points)
+    elapsed = time.perf_counter() - start
+    print("encoder      {:.2f}us per sample".format(elapsed / args.count * 1e6))
+
+
+def BenchPi30(args):
+    # the recorded frames must decode to what `mppsolar -o json` prints, then
+    # the native decoder is timed against parsing that json output, which is
+    # only the last step of the former path
+    for command, frame in sorted(pi30.FIXTURES.items()):
+        if command not in transport.FAKE_RESPONSES:
+            continue
+        decoded = pi30.Decode(command, frame)
+        if "warning_mask" in decoded:
+            decoded = warningmask.ToFields(decoded["warning_mask"])
+        if decoded != transport.FAKE_RESPONSES[command]:
+            sys.exit("{} fixture decodes to {}".format(command, decoded))
+
+        start = time.perf_counter()
+        for i in range(args.count):
+            pi30.Decode(command, frame)
+        native = (time.perf_counter() - start) / args.count
+
+        output = json.dumps(transport.FAKE_RESPONSES[command]).encode("utf-8")
+        start = time.perf_counter()
+        for i in range(args.count):
+            json.loads(output.decode("utf-8"))
+        parsed = (time.perf_counter() - start) / args.count
+        print(
+            "{:<12} native={:.2f}us json.loads={:.2f}us per frame".format(
+                command, native * 1e6, parsed * 1e6
+            )
+        )
+
+
+def BenchSpool(args):
+    # a day of 1Hz QPIGS samples, five measurements each
+    line = (
+        "battery,id=1 DC_V=52.6,DC_V_scc=52.61,charging_current=12i,"
+        "discharge_current=0i,soc=87i {}\n"
+    )
+    batch = "".join(line.format(i * 1000000000) for i in range(50)).encode("utf-8")
+    appends = args.samples * 5 // 50
+    path = tempfile.mkdtemp(prefix="influx-writer-spool-")
+    try:
+        backlog = spool.Spool({"path": path, "max_size": 1 << 40})
+        start = time.perf_counter()
+        for i in range(appends):
+            backlog.Append(batch)
+        backlog.Close()
+        elapsed = time.perf_counter() - start
+        print(
+            "append  {} lines, {:.1f} MB in {:.2f}s".format(
+                appends * 50, backlog.Size() / 1e6, elapsed
+            )
+        )
+
+        server = FakeInflux()
+        connection = http.client.HTTPConnection(*server.server_address)
+        size = 0
+        start = time.perf_counter()
+        for chunk in backlog.Replay():
+            connection.request("POST", "/write?db=bench", body=chunk)
+            connection.getresponse().read()
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        print(
+            "replay  {:.1f} MB in {:.2f}s, {:.0f} lines/s, {:.1f} MB/s".format(
+                size / 1e6, elapsed, appends * 50 / elapsed, size / 1e6 / elapsed
+            )
+        )
+    finally:
+        shutil.rmtree(path)
+
+
+def BenchSinks(args):
+    # fan QPIGS points out to a slow mqtt broker, prometheus and a file: adding
+    # them must stay as cheap as with no sink at all
+    FakeBrokerHandler.delay = args.delay
+    broker = FakeBroker()
+    path = tempfile.mkdtemp(prefix="influx-writer-sinks-")
+    outputs = sinks.NewSinks(
+        {
+            "mqtt": {"host": "127.0.0.1", "port": broker.server_address[1]},
+            "prometheus": {"host": "127.0.0.1", "port": 0},
+            "file": {"path": os.path.join(path, "points.lp")},
+        }
+    )
+    mapper = mapping.NewMappers({})["data"]
+    samples = []
+    for i in range(args.count):
+        points = mapper.Map(transport.FAKE_RESPONSES["QPIGS"], i, (("id", 1),))
+        start = time.perf_counter()
+        for sink in outputs:
+            sink.Add(points)
+        samples.append(time.perf_counter() - start)
+    Report("fan-out", samples)
+
+    prometheus = outputs[1].sink.server
+    connection = http.client.HTTPConnection(*prometheus.server_address)
+    time.sleep(0.5)
+    connection.request("GET", "/metrics")
+    metrics = connection.getresponse().read()
+    for sink in outputs:
+        sink.Close()
+    # the slow broker is still reading what the sink managed to send
+    deadline = time.monotonic() + 30
+    while FakeBrokerHandler.handling and time.monotonic() < deadline:
+        time.sleep(0.1)
+    broker.shutdown()
+    print(
+        "mqtt published {} of {} points, {} dropped".format(
+            FakeBrokerHandler.published, args.count * 5, outputs[0].dropped
+        )
+    )
+    print("prometheus {} series".format(metrics.count(b"\n")))
+    print(
+        "file {} lines".format(
+            open(os.path.join(path, "points.lp"), "rb").read().count(b"\n")
+        )
+    )
+    shutil.rmtree(path)
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, "localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def BenchSnapshot(args):
+    # read the last QPIGS answer back over keep-alive http and the unix socket
+    unit = type("Unit", (), {"id": 1, "responses": {}, "arbiter": None})()
+    path = tempfile.mkdtemp(prefix="influx-writer-snapshot-")
+    server = snapshot.SnapshotServer(
+        [unit], {"port": 0, "socket": os.path.join(path, "api.sock")}
+    )
+    connections = {
+        "http": http.client.HTTPConnection(*server.servers[0].server_address),
+        "unix": UnixConnection(os.path.join(path, "api.sock")),
+    }
+    for name, connection in connections.items():
+        for url in ("/1/QPIGS", "/1/QPIGS/battery_capacity"):
+            samples = []
+            for i in range(args.count):
+                if i % 10 == 0:
+                    # a new answer every 10 reads, as with 1Hz polling
+                    unit.responses["QPIGS"] = (
+                        transport.FAKE_RESPONSES["QPIGS"],
+                        time.time_ns(),
+                        time.monotonic(),
+                    )
+                start = time.perf_counter()
+                connection.request("GET", url)
+                connection.getresponse().read()
+                samples.append(time.perf_counter() - start)
+            Report("{} {}".format(name, url.split("/")[-1]), samples)
+        connection.close()
+    server.Close()
+    shutil.rmtree(path)
+
+
+def Rss():
+    # resident memory in MB, the peak where /proc is missing
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def LoadWriter():
+    # influx-writer.py is a script, its name is not importable
+    spec = importlib.util.spec_from_file_location("influx_writer", WRITER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def PipelineConf(args, port):
+    # the sections of --conf (batching, filter, rollup, sinks...) are kept, the
+    # devices are replaced by virtual inverters and influx by the fake server
+    conf = {"inverter_conf": {}}
+    if args.conf:
+        with open(args.conf, "r") as jsonfile:
+            conf = json.load(jsonfile)
+    conf["influx"] = dict(
+        conf.get("influx", {}),
+        host="127.0.0.1",
+        port=port,
+        database="bench",
+        backend="http",
+        ssl=False,
+        precision="ns",
+    )
+    conf["influx"].pop("token", None)
+    conf["influx"].pop("version", None)
+    # every report, short runs included, sees the points batched meanwhile
+    conf["influx"]["flush_interval"] = min(
+        conf["influx"].get("flush_interval", 10), args.report / 2, args.duration / 2
+    )
+    if args.child:
+        conf["inverterPoller"] = {
+            "transport": "child",
+            "child": [
+                sys.executable,
+                STUB_POLLER,
+                "--transport",
+                "fake",
+                "--latency",
+                str(args.latency),
+                "--failure-ratio",
+                str(args.failure_ratio),
+                "--jitter",
+                str(args.jitter),
+            ],
+        }
+    else:
+        conf["inverterPoller"] = {
+            "transport": "fake",
+            "latency": args.latency,
+            "failure_ratio": args.failure_ratio,
+            "jitter": args.jitter,
+        }
+    conf["devices"] = [{"id": index + 1} for index in range(args.inverters)]
+    schedule = conf.setdefault("schedule", {})
+    schedule["QPIGS"] = dict(schedule.get("QPIGS", {}), interval=args.interval)
+    schedule["QPIWS"] = dict(schedule.get("QPIWS", {}), interval=args.interval)
+    conf.pop("snapshot", None)
+    return conf
+
+
+def PipelineReport(name, elapsed, samples, points, latencies, cpu, rss):
+    if latencies:
+        latency = "p50={:8.1f}ms p95={:8.1f}ms p99={:8.1f}ms".format(
+            Percentile(latencies, 50) * 1000,
+            Percentile(latencies, 95) * 1000,
+            Percentile(latencies, 99) * 1000,
+        )
+    else:
+        latency = "no sample written yet"
+    print(
+        "{:<8} samples/s={:8.1f} points/s={:8.1f} {} cpu/sample={:.3f}ms "
+        "rss={:.1f}MB".format(
+            name,
+            samples / elapsed,
+            points / elapsed,
+            latency,
+            cpu / samples * 1000 if samples else 0,
+            rss,
+        )
+    )
+
+
+def BenchPipeline(args):
+    # poll virtual inverters through the whole writer, Inverter.Run with its
+    # schedulers, arbiters, mapping, batching and http writes, into the fake
+    # influx. The cpu time includes the fake inverters and server, which only
+    # copy a dict and split lines.
+    FakeInfluxHandler.track = True
+    server = FakeInflux()
+    path = tempfile.mkdtemp(prefix="influx-writer-pipeline-")
+    conf_path = os.path.join(path, "bench.conf")
+    with open(conf_path, "w") as jsonfile:
+        json.dump(PipelineConf(args, server.server_address[1]), jsonfile)
+    inverter = LoadWriter().Inverter(conf_path)
+    threading.Thread(
+        target=inverter.RunAsync if args.use_async else inverter.Run,
+        name="pipeline",
+        daemon=True,
+    ).start()
+
+    rss = Rss()
+    start = last = time.monotonic()
+    cpu = last_cpu = time.process_time()
+    latencies = []
+    samples = points = 0
+    while last - start < args.duration:
+        time.sleep(min(args.report, start + args.duration - last))
+        with FakeInfluxHandler.lock:
+            new_latencies = FakeInfluxHandler.latencies
+            FakeInfluxHandler.latencies = []
+            new_samples = FakeInfluxHandler.samples - samples
+            new_points = FakeInfluxHandler.points - points
+            samples = FakeInfluxHandler.samples
+            points = FakeInfluxHandler.points
+        now, now_cpu = time.monotonic(), time.process_time()
+        latencies += new_latencies
+        PipelineReport(
+            "{:.0f}s".format(now - start),
+            now - last,
+            new_samples,
+            new_points,
+            new_latencies,
+            now_cpu - last_cpu,
+            Rss(),
+        )
+        last, last_cpu = now, now_cpu
+
+    # the points still batched are written on close, the total counts them
+    inverter.Close()
+    with FakeInfluxHandler.lock:
+        latencies += FakeInfluxHandler.latencies
+        FakeInfluxHandler.latencies = []
+        samples = FakeInfluxHandler.samples
+        points = FakeInfluxHandler.points
+    server.shutdown()
+    shutil.rmtree(path)
+    PipelineReport(
+        "total",
+        last - start,
+        samples,
+        points,
+        latencies,
+        last_cpu - cpu,
+        Rss(),
+    )
+    stats = [unit.arbiter.Stats() for unit in inverter.devices]
+    print(
+        "{} inverters, {} commands sent, {} failed, memory grew {:+.1f}MB".format(
+            len(stats),
+            sum(stat["sent"] for stat in stats),
+            sum(stat["errors"] for stat in stats),
+            Rss() - rss,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    parser_transport = subparsers.add_parser(
+        "transport", help="per command latency of an inverter transport"
+    )
+    parser_transport.add_argument(
+        "-c", "--conf", help="config file to take the inverterPoller section from"
+    )
+    parser_transport.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="simulated device latency when no config is given",
+    )
+    parser_transport.add_argument("-n", "--count", type=int, default=100)
+    parser_transport.add_argument(
+        "commands", nargs="*", default=["QPIGS", "QPIWS", "QPIRI", "QFLAG"]
+    )
+    parser_transport.set_defaults(func=BenchTransport)
+
+    parser_child = subparsers.add_parser(
+        "child", help="spawn per poll against a persistent poller child"
+    )
+    parser_child.add_argument("-n", "--count", type=int, default=50)
+    parser_child.set_defaults(func=BenchChild)
+
+    parser_mapping = subparsers.add_parser(
+        "mapping", help="hand written against compiled QPIGS mapping"
+    )
+    parser_mapping.add_argument("-n", "--count", type=int, default=100000)
+    parser_mapping.set_defaults(func=BenchMapping)
+
+    parser_encode = subparsers.add_parser(
+        "encode", help="map and encode a batch of QPIGS samples to line protocol"
+    )
+    parser_encode.add_argument("-n", "--count", type=int, default=10000)
+    parser_encode.set_defaults(func=BenchEncode)
+
+    parser_pi30 = subparsers.add_parser(
+        "pi30", help="check the recorded PI30 frames and time their decoding"
+    )
+    parser_pi30.add_argument("-n", "--count", type=int, default=100000)
+    parser_pi30.set_defaults(func=BenchPi30)
+
+    parser_spool = subparsers.add_parser(
+        "spool", help="spool append and replay throughput against a local server"
+    )
+    parser_spool.add_argument(
+        "--samples", type=int, default=86400, help="spooled QPIGS samples"
+    )
+    parser_spool.set_defaults(func=BenchSpool)
+
+    parser_sinks = subparsers.add_parser(
+        "sinks", help="fan QPIGS points out to mqtt, prometheus and file sinks"
+    )
+    parser_sinks.add_argument("-n", "--count", type=int, default=1000)
+    parser_sinks.add_argument(
+        "--delay", type=float, default=0.001, help="broker delay per publish"
+    )
+    parser_sinks.set_defaults(func=BenchSinks)
+
+    parser_snapshot = subparsers.add_parser(
+        "snapshot", help="latency of snapshot reads over http and unix socket"
+    )
+    parser_snapshot.add_argument("-n", "--count", type=int, default=2000)
+    parser_snapshot.set_defaults(func=BenchSnapshot)
+
+    parser_pipeline = subparsers.add_parser(
+        "pipeline", help="virtual inverters through the whole writer to a fake influx"
+    )
+    parser_pipeline.add_argument(
+        "-c", "--conf", help="config file to take batching, filter, sinks... from"
+    )
+    parser_pipeline.add_argument("--inverters", type=int, default=10)
+    parser_pipeline.add_argument(
+        "--interval", type=float, default=1.0, help="QPIGS and QPIWS period"
+    )
+    parser_pipeline.add_argument(
+        "--latency", type=float, default=0.05, help="inverter answer delay"
+    )
+    parser_pipeline.add_argument(
+        "--failure-ratio", type=float, default=0.0, help="unanswered commands"
+    )
+    parser_pipeline.add_argument(
+        "--jitter", type=float, default=0.02, help="drift of the inverter values"
+    )
+    parser_pipeline.add_argument(
+        "--child",
+        action="store_true",
+        help="answer from stub poller processes instead of in process",
+    )
+    parser_pipeline.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="run the asyncio runner instead of a thread per inverter",
+    )
+    parser_pipeline.add_argument(
+        "--duration", type=float, default=60, help="seconds to run"
+    )
+    parser_pipeline.add_argument(
+        "--report", type=float, default=10, help="seconds between reports"
+    )
+    parser_pipeline.set_defaults(func=BenchPipeline)
+
+    args = parser.parse_args()
+    args.func(args)
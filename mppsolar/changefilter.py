@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import adaptive
+
+
+class ChangeFilter:
+    # drop the fields that did not change enough since they were last written.
+    # Rules come from the filter config section, looked up per field, then per
+    # measurement ("*") and then "default":
+    #   {"mode": "all"}                 always written
+    #   {"mode": "change"}              written when the value changed
+    #   {"mode": "deadband", "abs": 0.2, "pct": 1}
+    #                                   written when it moved by more than abs
+    #                                   or pct percent of the last written value
+    # and "heartbeat": seconds forces a write once in a while whatever the mode.
+    def __init__(self, conf):
+        self.conf = conf
+        self.default = conf.get("default", {"mode": "all"})
+        self.rules = {}
+        self.state = {}
+
+    def Rule(self, measurement, field):
+        rules = self.conf.get(measurement, {})
+        rule = rules.get(field) or rules.get("*") or self.default
+        compiled = (
+            rule.get("mode", "change"),
+            rule.get("abs"),
+            rule.get("pct"),
+            rule["heartbeat"] * 1000000000 if "heartbeat" in rule else None,
+        )
+        self.rules[(measurement, field)] = compiled
+        return compiled
+
+    def Changed(self, rule, value, last):
+        mode, absolute, pct, heartbeat = rule
+        if mode == "change" or isinstance(value, (str, bool)):
+            return value != last
+        if not isinstance(last, (int, float)) or isinstance(last, bool):
+            return True
+        delta = abs(value - last)
+        if absolute is not None and delta > absolute:
+            return True
+        if pct is not None and delta * 100 > pct * abs(last):
+            return True
+        return absolute is None and pct is None and delta > 0
+
+    def Filter(self, points):
+        filtered = []
+        for measurement, tags, fields, time in points:
+            state = self.state.setdefault((measurement, adaptive.Series(tags)), {})
+            kept = {}
+            for field, value in fields.items():
+                rule = self.rules.get((measurement, field)) or self.Rule(
+                    measurement, field
+                )
+                if rule[0] == "all":
+                    kept[field] = value
+                    continue
+                last = state.get(field)
+                if (
+                    last is None
+                    or (rule[3] is not None and time - last[1] >= rule[3])
+                    or self.Changed(rule, value, last[0])
+                ):
+                    kept[field] = value
+                    state[field] = (value, time)
+            if kept:
+                filtered.append((measurement, tags, kept, time))
+        return filtered
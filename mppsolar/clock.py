@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import syslog
+import time
+
+
+class Clock:
+    # utc nanoseconds counted on the monotonic clock from a single reading of
+    # the wall clock: stamps do not jump back and forth when ntp steps the time
+    # and, being utc, know nothing of dst. The anchor only moves once the wall
+    # clock drifted more than max_drift seconds away, e.g. on the first ntp
+    # sync of a board without rtc.
+    def __init__(self, max_drift=1.0, check_interval=60):
+        self.max_drift = int(max_drift * 1e9)
+        self.check_interval = int(check_interval * 1e9)
+        mono = time.monotonic_ns()
+        self.offset = time.time_ns() - mono
+        self.checked = mono
+
+    def Check(self, mono):
+        self.checked = mono
+        drift = time.time_ns() - (self.offset + mono)
+        if abs(drift) > self.max_drift:
+            syslog.syslog(
+                syslog.LOG_WARNING,
+                "wall clock moved {:.3f}s away, anchoring stamps on it again".format(
+                    drift / 1e9
+                ),
+            )
+            self.offset += drift
+
+    def Now(self):
+        mono = time.monotonic_ns()
+        if mono - self.checked > self.check_interval:
+            self.Check(mono)
+        return self.offset + mono
+
+
+# shared by the devices and the writer, so every stamp comes from one anchor
+CLOCK = Clock()
+
+
+def Now():
+    return CLOCK.Now()
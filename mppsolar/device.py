@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import arbiter
+import clock
+import time
+import transport
+
+# seconds before a failed configuration read or reconcile is tried again,
+# doubled on every failure up to CONF_RETRY_MAX
+CONF_RETRY = 10
+CONF_RETRY_MAX = 10 * 60
+
+
+class Device:
+    # one inverter unit: its transport, the id its points are tagged with and
+    # the state its polling jobs keep between two ticks
+    def __init__(self, conf):
+        self.conf = conf
+        self.id = conf.get("id", 1)
+        self.transport = transport.NewTransport(conf)
+        # every command to the device, polls and settings, goes through it
+        self.arbiter = arbiter.Arbiter(self.transport, conf)
+        self.failCount = 0
+        self.warning_due = False
+        self.inverter_warning = {}
+        self.warning_mask = None
+        self.inverter_current_conf = {}
+        self.reconciler = None
+        # the inverter_conf changed, reconcile before the next QPIRI tick: read
+        # once, see ConfDue, and after a failure once conf_retry is reached
+        self.conf_due = False
+        self.conf_retry = 0.0
+        self.conf_backoff = 0
+        self.schedule = None
+        # QPIGS rate following the signal, see the adaptive config section
+        self.adaptive = None
+        # command -> (response, utc ns stamp, monotonic time) of the last answer
+        self.responses = {}
+        self.stats = None
+
+    def Send(self, command):
+        return self.arbiter.Send(command)
+
+    def PolInverter(self, command):
+        if self.stats is None:
+            response = self.Send(command)
+        else:
+            response = self.TimedSend(command)
+        if "validity_check" in response:
+            raise ValueError(
+                "Response unexpected: {}".format(response["validity_check"])
+            )
+        self.Record(command, response)
+        return response
+
+    def TimedSend(self, command):
+        # queue wait and exchange, a failed or refused command counts as error
+        start = time.monotonic()
+        failed = True
+        try:
+            response = self.Send(command)
+            failed = "validity_check" in response
+            return response
+        finally:
+            self.stats.Record(
+                "poll_{}".format(command), time.monotonic() - start, failed
+            )
+
+    def Record(self, command, response):
+        # a new tuple each time, readers never see a half updated entry
+        self.responses[command] = (response, clock.Now(), time.monotonic())
+
+    def Stamp(self, command):
+        # when the last answer to command came in, what its points are stamped with
+        return self.responses[command][1]
+
+    def Reconcile(self):
+        # read the configuration and reconcile it as soon as possible
+        self.conf_backoff = 0
+        self.conf_retry = 0.0
+        self.conf_due = True
+
+    def ConfDue(self):
+        # true once per due read, the caller sends it
+        if not self.conf_due or time.monotonic() < self.conf_retry:
+            return False
+        self.conf_due = False
+        return True
+
+    def ConfFailed(self):
+        self.conf_backoff = min(self.conf_backoff * 2 or CONF_RETRY, CONF_RETRY_MAX)
+        self.conf_retry = time.monotonic() + self.conf_backoff
+        self.conf_due = True
+
+    def ConfApplied(self):
+        self.conf_backoff = 0
+        self.conf_retry = 0.0
+
+    def Close(self):
+        self.arbiter.Close()
+
+    def PolDataInverter(self):
+        return self.PolInverter("QPIGS")
+
+    def PolConfInverter(self):
+        return self.PolInverter("QPIRI")
+
+    def PolFlagInverter(self):
+        return self.PolInverter("QFLAG")
+
+    def PolWarningInverter(self):
+        return self.PolInverter("QPIWS")
+
+
+def DeviceConfs(conf):
+    # every entry of the devices section is merged over the inverterPoller one,
+    # without it the inverterPoller section describes the single device
+    confs = []
+    for entry in conf.get("devices") or [{}]:
+        device_conf = dict(conf["inverterPoller"])
+        device_conf.update(entry)
+        confs.append(device_conf)
+    return confs
+
+
+def NewDevices(conf):
+    return [Device(device_conf) for device_conf in DeviceConfs(conf)]
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import http.client
+import random
+import ssl
+import syslog
+import time
+import urllib.parse
+import lineprotocol
+
+
+class InfluxHttpWriter:
+    # posts line protocol over a single keep-alive connection, to the 1.x
+    # /write endpoint or to the 2.x /api/v2/write one when the influx section
+    # has a token (or "version": 2). Bodies are gzipped, failed requests are
+    # retried with exponential backoff and jitter from the writer thread, so
+    # the pollers never wait on them.
+    def __init__(self, conf):
+        self.host = conf["host"]
+        self.port = conf["port"]
+        self.ssl = conf.get("ssl", False)
+        self.verify_ssl = conf.get("verify_ssl", True)
+        self.version = conf.get("version", 2 if "token" in conf else 1)
+        self.connect_timeout = conf.get("connect_timeout", 5)
+        self.read_timeout = conf.get("read_timeout", conf.get("timeout", 10))
+        self.gzip = conf.get("gzip", True)
+        self.gzip_level = conf.get("gzip_level", 6)
+        self.retries = conf.get("retries", 3)
+        self.backoff = conf.get("backoff", 0.5)
+        self.max_backoff = conf.get("max_backoff", 30)
+        self.precision = lineprotocol.PRECISIONS[conf.get("precision", "ns")]
+        self.headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if self.version == 2:
+            self.headers["Authorization"] = "Token {}".format(conf["token"])
+            params = {
+                "org": conf["org"],
+                "bucket": conf["bucket"],
+                "precision": self.precision[2],
+            }
+            self.path = "/api/v2/write"
+        else:
+            self.database = conf["database"]
+            self.auth = {"u": conf.get("user", ""), "p": conf.get("password", "")}
+            params = dict(self.auth, db=self.database, precision=self.precision[1])
+            self.path = "/write"
+        self.target = "{}?{}".format(self.path, urllib.parse.urlencode(params))
+        if self.gzip:
+            self.headers["Content-Encoding"] = "gzip"
+        self.connection = None
+        self.stats = None
+
+    def Connect(self):
+        if self.ssl:
+            context = ssl.create_default_context()
+            if not self.verify_ssl:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            connection = http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.connect_timeout, context=context
+            )
+        else:
+            connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.connect_timeout
+            )
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        self.connection = connection
+
+    def Request(self, target, body, headers):
+        if self.connection is None:
+            self.Connect()
+        try:
+            self.connection.request("POST", target, body, headers)
+            response = self.connection.getresponse()
+            # read it all, the connection is reused for the next request
+            content = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.Close()
+            raise e
+        if response.will_close:
+            self.Close()
+        return response.status, content, response.getheader("Retry-After")
+
+    def Body(self, data):
+        if self.gzip:
+            return gzip.compress(data, self.gzip_level)
+        return data
+
+    def Backoff(self, attempt, retry_after=None):
+        # full jitter: a random delay up to the exponential backoff
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, min(self.max_backoff, int(retry_after)))
+        return delay
+
+    def CreateTarget(self):
+        return "/query?{}".format(
+            urllib.parse.urlencode(
+                dict(self.auth, q='CREATE DATABASE "{}"'.format(self.database))
+            )
+        )
+
+    def CreateDatabase(self):
+        syslog.syslog(
+            syslog.LOG_WARNING,
+            "{} database not found, intempting to create now".format(self.database),
+        )
+        self.Request(self.CreateTarget(), b"", {})
+
+    def Write(self, data):
+        body = self.Body(data)
+        created = False
+        attempt = 0
+        while True:
+            reused = self.connection is not None
+            retry_after = None
+            try:
+                status, content, retry_after = self.Request(
+                    self.target, body, self.headers
+                )
+            except (OSError, http.client.HTTPException) as e:
+                if reused:
+                    # the server dropped the idle connection, try a fresh one
+                    if self.stats is not None:
+                        self.stats.Count("influx_reconnects")
+                    continue
+                error = e
+            else:
+                if status == 204:
+                    return
+                error = IOError("influx answered {}: {}".format(status, content[:200]))
+                if status == 404 and self.version == 1 and not created:
+                    self.CreateDatabase()
+                    created = True
+                    continue
+                # other client errors will not get better by retrying
+                if status != 429 and status < 500:
+                    raise error
+            if attempt >= self.retries:
+                raise error
+            delay = self.Backoff(attempt, retry_after)
+            if self.stats is not None:
+                self.stats.Count("influx_retries")
+            syslog.syslog(
+                syslog.LOG_WARNING,
+                "influx write failed ({}), retrying in {:.1f}s".format(error, delay),
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def Close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -1,630 +1,632 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import subprocess
+import functools
+import os
+import signal
 import syslog
-import json
-from datetime import datetime, timedelta
-import influxdb
+import threading
 import time
+import json
+import adaptive
+import batchwriter
+import changefilter
+import clock
+import device
+import httpwriter
+import lineprotocol
+import mapping
+import reconciler
+import rollup
+import scheduler
+import spool
+import startup
+import stats
+import warningmask
+
+# the sink libraries, the influxdb client and asyncio are imported when the
+# config asks for them, see NewInflux, NewSinks and RunAsync
+startup.STARTUP.Mark("imports")
+
+
+# sections a reload cannot apply, they hold listeners and device handles
+RESTART_SECTIONS = ("inverterPoller", "snapshot", "stats")
+# the keys of a device entry a reload applies
+RELOADABLE_DEVICE_KEYS = ("inverter_conf", "schedule")
+
+
+def Fixed(unit_conf):
+    # what a reload cannot change of a device
+    return {
+        key: value
+        for key, value in unit_conf.items()
+        if key not in RELOADABLE_DEVICE_KEYS
+    }
 
 
 class Inverter:
     # init class loading config file value
     def __init__(self, config_path):
+        self.config_path = config_path
+        self.conf = self.LoadConf()
+        startup.STARTUP.Mark("config")
+        # held while a sample is mapped and emitted, a reload swaps the
+        # components it rebuilt under it so no sample sees half of them
+        self.lock = threading.Lock()
+        self.reload_requested = threading.Event()
+        # called after a reload, e.g. by the asyncio runner
+        self.reload_hooks = []
+
+        # timing of the hot path stages, see the stats config section
+        self.stats = stats.Stats(self.conf["stats"]) if "stats" in self.conf else None
+        write, self.influx = self.NewInflux(self.conf["influx"])
+        # points carry ns stamps, truncated to the write precision when encoded
+        self.precision = self.conf["influx"].get("precision", "ns")
+        self.encoder = lineprotocol.LineEncoder(self.precision)
+        self.writer = batchwriter.BatchWriter(
+            self.EncodePoints,
+            write,
+            self.conf["influx"],
+            (
+                spool.Spool(self.conf["influx"]["spool"])
+                if "spool" in self.conf["influx"]
+                else None
+            ),
+        )
+        # compiled once, see mapping.DEFAULT_MAPPING and the mapping config section
+        self.mappers = mapping.NewMappers(self.conf.get("mapping", {}))
+        self.change_filter = (
+            changefilter.ChangeFilter(self.conf["filter"])
+            if "filter" in self.conf
+            else None
+        )
+        self.rollup = (
+            rollup.Rollup(self.conf["rollup"]) if "rollup" in self.conf else None
+        )
+        # mqtt, prometheus and file outputs fed next to influx
+        self.sinks = self.NewSinks(self.conf.get("sinks", {}))
+        # the transports open the device on their first command, an unplugged
+        # inverter only fails its polls
+        self.devices = device.NewDevices(self.conf)
+        # local tools read the last answers from here instead of the device
+        self.snapshot = None
+        if "snapshot" in self.conf:
+            import snapshot
+
+            self.snapshot = snapshot.SnapshotServer(
+                self.devices, self.conf["snapshot"], self.stats
+            )
+        for unit in self.devices:
+            unit.reconciler = reconciler.Reconciler(self.InverterConf(unit))
+            unit.adaptive = self.NewAdaptive(self.conf)
+            unit.stats = self.stats
+            unit.arbiter.stats = self.stats
+        startup.STARTUP.Mark("init")
+
+    def LoadConf(self):
         try:
-            with open(config_path, "r") as jsonfile:
-                config = json.load(jsonfile)
-                # store the wall config in this var to update the config file
-                self.conf = config
+            with open(self.config_path, "r") as jsonfile:
+                return json.load(jsonfile)
         except Exception as e:
             syslog.syslog(syslog.LOG_ERR, "Failed to load configuration: {}".format(e))
             raise e
 
-        self.status_timer = datetime.now()
-        self.influx_client = influxdb.InfluxDBClient(
-            self.conf["influx"]["host"],
-            self.conf["influx"]["port"],
-            self.conf["influx"]["user"],
-            self.conf["influx"]["password"],
-            self.conf["influx"]["database"],
+    def NewInflux(self, conf):
+        # keep-alive http writer by default, the influxdb client on request
+        if conf.get("backend", "http") == "http":
+            influx = httpwriter.InfluxHttpWriter(conf)
+            influx.stats = self.stats
+            write = influx.Write
+        else:
+            import influxdb
+
+            influx = influxdb.InfluxDBClient(
+                conf["host"],
+                conf["port"],
+                conf["user"],
+                conf["password"],
+                conf["database"],
+            )
+            write = functools.partial(self.InfluxWrite, influx)
+        if self.stats is not None:
+            write = functools.partial(self.TimedWrite, write)
+        write = functools.partial(self.StartupWrite, write)
+        return write, influx
+
+    def NewSinks(self, conf):
+        if not conf:
+            return []
+        import sinks
+
+        return sinks.NewSinks(conf)
+
+    def NewAdaptive(self, conf):
+        if "adaptive" not in conf:
+            return None
+        return adaptive.AdaptiveRate(conf["adaptive"])
+
+    def InverterConf(self, unit):
+        return unit.conf.get("inverter_conf", self.conf["inverter_conf"])
+
+    def ScheduleConf(self, unit):
+        # a device entry can override the schedule section with its own
+        schedule_conf = dict(self.conf.get("schedule", {}))
+        schedule_conf.update(unit.conf.get("schedule", {}))
+        return schedule_conf
+
+    def ApplyInverterConf(self, unit, rawConf):
+        # only the settings the inverter does not match are sent, then read
+        # back, see reconciler.Reconciler. Returns the configuration read back
+        # and a config_apply point when something had to be changed.
+        rawConf, attempt = unit.reconciler.Apply(unit.PolInverter, rawConf)
+        if attempt is None:
+            return rawConf, []
+        return rawConf, [
+            ("config_apply", (("id", unit.id),), attempt, unit.Stamp("QPIRI"))
+        ]
+
+    def Timestamp(self, when=None):
+        # when is the utc ns stamp of the device answer, see Device.Stamp
+        if when is None:
+            return clock.Now()
+        return when
+
+    def MapData(self, data, when=None, device_id=1, interval=None):
+        tags = (("id", device_id),)
+        if interval is not None:
+            tags += (("interval", interval),)
+        return self.mappers["data"].Map(data, self.Timestamp(when), tags)
+
+    def MapSample(self, unit, data, when):
+        # with an adaptive rate the points are tagged with the interval they
+        # were sampled at, and the sample sets the next one
+        if unit.adaptive is None:
+            return self.MapData(data, when, unit.id)
+        points = self.MapData(data, when, unit.id, unit.adaptive.Tag())
+        unit.adaptive.Observe({point[0]: point[2] for point in points})
+        return points
+
+    def MapConfig(self, data, when=None, device_id=1):
+        return self.mappers["config"].Map(
+            data, self.Timestamp(when), (("id", device_id),)
         )
-        self.inverter_warning = self.PolWarningInverter()
 
-        tmp = self.PolConfInverter()
-        for key, value in self.conf["inverter_conf"].items():
-            if key in tmp.items():
-                tmp[key] = value
-        self.inverter_current_conf = tmp
+    def MapWarning(self, data, when=None, device_id=1):
+        if "warning_mask" in data:
+            data = warningmask.ToFields(data["warning_mask"])
+        return self.mappers["warning"].Map(
+            data, self.Timestamp(when), (("id", device_id),)
+        )
 
-    def PolDataInverter(self):
-        try:
-            inverter_data = subprocess.check_output(
-                [
-                    self.conf["inverterPoller"]["venv"],
-                    self.conf["inverterPoller"]["path"],
-                    "-p",
-                    "/dev/hidraw0",
-                    "-o",
-                    "json",
-                    "-c",
-                    "QPIGS",
-                ]
-            )
-        except subprocess.CalledProcessError as e:
-            syslog.syslog(
-                syslog.LOG_ERR, "inverter_poller returned with error {}".format(e)
-            )
-            raise e
-        response = json.loads(inverter_data.decode("utf-8"))
-        if "validity_check" in response:
-            raise ValueError(
-                "Response unexpected: {}".format(response["validity_check"])
+    def MapWarningChanges(self, unit, data, when=None):
+        # one xor against the previous mask tells the raised and cleared
+        # warnings, nothing is written while it stays the same
+        mask = warningmask.FromResponse(data)
+        previous = unit.warning_mask
+        unit.warning_mask = mask
+        unit.inverter_warning = data
+        if mask == previous:
+            return []
+        return warningmask.Events(
+            previous or 0, mask, (("id", unit.id),), self.Timestamp(when)
+        ) + self.MapWarning(data, when, unit.id)
+
+    def MapFlag(self, data, when=None, device_id=1):
+        return [
+            (
+                "flag",
+                (("id", device_id),),
+                {key: value == "enabled" for key, value in data.items()},
+                self.Timestamp(when),
             )
-        return response
+        ]
+
+    def Aggregate(self, points):
+        # the data points go through the rollups, which keep the raw points due
+        if self.rollup is None:
+            return points
+        return self.rollup.Add(points)
+
+    def Emit(self, points):
+        if self.change_filter is not None:
+            points = self.change_filter.Filter(points)
+        if points:
+            self.writer.Add(points)
+            for sink in self.sinks:
+                sink.Add(points)
 
-    def PolConfInverter(self):
+    def EncodePoints(self, points):
+        return self.encoder.Encode(points)
+
+    def TimedWrite(self, write, data):
+        start = time.monotonic()
+        failed = True
         try:
-            inverter_data = subprocess.check_output(
-                [
-                    self.conf["inverterPoller"]["venv"],
-                    self.conf["inverterPoller"]["path"],
-                    "-p",
-                    "/dev/hidraw0",
-                    "-o",
-                    "json",
-                    "-c",
-                    "QPIRI",
-                ]
-            )
-        except subprocess.CalledProcessError as e:
-            syslog.syslog(
-                syslog.LOG_ERR, "inverter_poller returned with error {}".format(e)
-            )
-            raise e
-        response = json.loads(inverter_data.decode("utf-8"))
-        if "validity_check" in response:
-            raise ValueError(
-                "Response unexpected: {}".format(response["validity_check"])
-            )
-        return response
+            write(data)
+            failed = False
+        finally:
+            self.stats.Record("influx_write", time.monotonic() - start, failed)
 
-    def PolFlagInverter(self):
+    def StartupWrite(self, write, data):
+        write(data)
+        if startup.STARTUP.Mark("first_write"):
+            self.ReportStartup()
+
+    def ReportStartup(self):
+        # how long each step took until the first batch reached influx
+        syslog.syslog(
+            syslog.LOG_INFO,
+            "first write {:.0f}ms after process start: {}".format(
+                startup.STARTUP.Total() * 1000,
+                ", ".join(
+                    "{} {:.0f}ms".format(name, elapsed * 1000)
+                    for name, elapsed in startup.STARTUP.Breakdown()
+                ),
+            ),
+        )
+        if self.stats is not None:
+            for name, age in startup.STARTUP.marks:
+                self.stats.Set("startup_{}_ms".format(name), round(age * 1000, 1))
+
+    def InfluxWrite(self, client, data):
+        # called from the writer thread with a whole batch of line protocol,
+        # sent as a single request
+        import influxdb
+
+        params = {
+            "db": self.conf["influx"]["database"],
+            "precision": lineprotocol.PRECISIONS[self.precision][1],
+        }
         try:
-            inverter_data = subprocess.check_output(
-                [
-                    self.conf["inverterPoller"]["venv"],
-                    self.conf["inverterPoller"]["path"],
-                    "-p",
-                    "/dev/hidraw0",
-                    "-o",
-                    "json",
-                    "-c",
-                    "QFLAG",
-                ]
+            client.request(
+                "write",
+                method="POST",
+                params=params,
+                data=data,
+                expected_response_code=204,
             )
-        except subprocess.CalledProcessError as e:
+        except influxdb.exceptions.InfluxDBClientError as e:
+            if e.code != 404:
+                raise e
             syslog.syslog(
-                syslog.LOG_ERR, "inverter_poller returned with error {}".format(e)
+                syslog.LOG_WARNING,
+                "{} database not found, intempting to create now".format(
+                    self.conf["influx"]["database"]
+                ),
             )
-            raise e
-        response = json.loads(inverter_data.decode("utf-8"))
-        if "validity_check" in response:
-            raise ValueError(
-                "Response unexpected: {}".format(response["validity_check"])
+            client.create_database(self.conf["influx"]["database"])
+            client.request(
+                "write",
+                method="POST",
+                params=params,
+                data=data,
+                expected_response_code=204,
             )
-        return response
 
-    def PolWarningInverter(self):
+    def DataJob(self, unit, when):
         try:
-            inverter_data = subprocess.check_output(
-                [
-                    self.conf["inverterPoller"]["venv"],
-                    self.conf["inverterPoller"]["path"],
-                    "-p",
-                    "/dev/hidraw0",
-                    "-o",
-                    "json",
-                    "-c",
-                    "QPIWS",
-                ]
-            )
-        except subprocess.CalledProcessError as e:
+            rawData = unit.PolDataInverter()
+        except Exception as e:
             syslog.syslog(
-                syslog.LOG_ERR, "inverter_poller returned with error {}".format(e)
-            )
-            raise e
-
-        response = json.loads(inverter_data.decode("utf-8"))
-        if "validity_check" in response.items():
-            raise ValueError(
-                "Response unexpected: {}".format(response["validity_check"])
+                syslog.LOG_ERR,
+                "Failed to poll data from inverter {}: {}".format(unit.id, e),
             )
-        return response
-
-    def ApplyInverterConf(self):
-        if "battery_type" in self.conf["inverter_conf"]:
-            if self.conf["inverter_conf"]["battery_type"] == "AGM":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "PBT00",
-                    ]
-                )
-            elif self.conf["inverter_conf"]["battery_type"] == "Flooded":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "PBT01",
-                    ]
-                )
-            elif self.conf["inverter_conf"]["battery_type"] == "User":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "PBT02",
-                    ]
-                )
-            else:
+            unit.failCount += 1
+            if unit.failCount % 10 > 8:
                 syslog.syslog(
-                    syslog.LOG_WARNING,
-                    "battery_type not found {}".format(
-                        self.conf["inverter_conf"]["battery_type"]
+                    syslog.LOG_ERR,
+                    "Inverter {} polling failed in a {} time in a raw".format(
+                        unit.id, unit.failCount
                     ),
                 )
-
-        if "charger_source_priority" in self.conf["inverter_conf"]:
-            if self.conf["inverter_conf"]["charger_source_priority"] == "Utility first":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "PCP00",
-                    ]
-                )
-            elif self.conf["inverter_conf"]["charger_source_priority"] == "Solar first":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "PCP01",
-                    ]
-                )
-            elif (
-                self.conf["inverter_conf"]["charger_source_priority"]
-                == "Solar + utility"
-            ):
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "PCP02",
-                    ]
-                )
-            elif (
-                self.conf["inverter_conf"]["charger_source_priority"]
-                == "Only solar charging permitted"
-            ):
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "PCP03",
-                    ]
-                )
+            return
+        unit.failCount = 0
+        startup.STARTUP.Mark("first_sample")
+        if unit.ConfDue():
+            # the configuration is read once the live data got through
+            unit.schedule.Trigger("QPIRI")
+        when = unit.Stamp("QPIGS")
+        with self.lock:
+            if self.stats is None:
+                self.Emit(self.Aggregate(self.MapSample(unit, rawData, when)))
             else:
-                syslog.syslog(
-                    syslog.LOG_WARNING,
-                    "charger_source_priority type not found {}".format(
-                        self.conf["inverter_conf"]["device_charger_priority"]
-                    ),
-                )
+                start = time.monotonic()
+                points = self.Aggregate(self.MapSample(unit, rawData, when))
+                self.stats.Record("map_data", time.monotonic() - start)
+                self.Emit(points)
+            if unit.adaptive is not None:
+                unit.schedule.SetInterval("QPIGS", unit.adaptive.interval)
 
-        if "output_source_priority" in self.conf["inverter_conf"]:
-            if self.conf["inverter_conf"]["output_source_priority"] == "Utility first":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "POP00",
-                    ]
-                )
-            elif self.conf["inverter_conf"]["output_source_priority"] == "Solar first":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "POP01",
-                    ]
-                )
-            elif self.conf["inverter_conf"]["output_source_priority"] == "SBU first":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        "POP02",
-                    ]
-                )
-            else:
-                syslog.syslog(
-                    syslog.LOG_WARNING,
-                    "output_source_priority type not found {}".format(
-                        self.conf["inverter_conf"]["battery_type"]
-                    ),
-                )
+    def WarningJob(self, unit, when):
+        rawWarn = unit.PolWarningInverter()
+        when = unit.Stamp("QPIWS")
+        with self.lock:
+            previous = unit.warning_mask
+            payload = self.MapWarningChanges(unit, rawWarn, when)
+            if unit.adaptive is not None and unit.warning_mask & ~(previous or 0):
+                # a warning was raised, the transient is sampled at the fast rate
+                unit.adaptive.Alert()
+                unit.schedule.SetInterval("QPIGS", unit.adaptive.interval)
+            if unit.warning_due and not payload:
+                payload = self.MapWarning(rawWarn, when, unit.id)
+            unit.warning_due = False
+            if payload:
+                self.Emit(payload)
 
-        pe_option = "PE"
-        pd_option = "PD"
-        if "buzzer" in self.conf["inverter_conf"]:
-            if self.conf["inverter_conf"]["buzzer"]:
-                pe_option = "{}a".format(pe_option)
-            else:
-                pd_option = "{}a".format(pd_option)
-        if "overload_bypass" in self.conf["inverter_conf"]:
-            if self.conf["inverter_conf"]["overload_bypass"]:
-                pe_option = "{}b".format(pe_option)
-            else:
-                pd_option = "{}b".format(pd_option)
-        if "power_saving" in self.conf["inverter_conf"]:
-            if self.conf["inverter_conf"]["power_saving"]:
-                pe_option = "{}j".format(pe_option)
-            else:
-                pd_option = "{}j".format(pd_option)
-        if "overload_restart" in self.conf["inverter_conf"]:
-            if self.conf["inverter_conf"]["overload_restart"]:
-                pe_option = "{}u".format(pe_option)
-            else:
-                pd_option = "{}u".format(pd_option)
-        if "over_temperature_restart" in self.conf["inverter_conf"]:
-            if self.conf["inverter_conf"]["over_temperature_restart"]:
-                pe_option = "{}v".format(pe_option)
-            else:
-                pd_option = "{}v".format(pd_option)
-        inverter_data = ""
-        try:
-            if pe_option != "PE":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        pe_option,
-                    ]
-                )
-            if pd_option != "PD":
-                inverter_data = subprocess.check_output(
-                    [
-                        self.conf["inverterPoller"]["venv"],
-                        self.conf["inverterPoller"]["path"],
-                        "-p",
-                        "/dev/hidraw0",
-                        "-o",
-                        "json",
-                        "-c",
-                        pd_option,
-                    ]
-                )
+    def WarningHeartbeatJob(self, unit, when):
+        # write the warnings even when nothing changed, once in a while
+        unit.warning_due = True
 
-        except subprocess.CalledProcessError as e:
-            syslog.syslog(
-                syslog.LOG_ERR,
-                "inverter_poller returned with error {} runnig PE: {} or PD: {} command: ".format(
-                    e, pe_option, pd_option
-                ),
-            )
+    def ConfJob(self, unit, when):
+        # this read serves a due one, a failed read or reconcile is tried again
+        # after a backoff, see Device.ConfFailed, not after every sample
+        unit.conf_due = False
+        try:
+            rawConf, payload = self.ApplyInverterConf(unit, unit.PolConfInverter())
+        except Exception as e:
+            unit.ConfFailed()
             raise e
+        unit.ConfApplied()
+        with self.lock:
+            if rawConf != unit.inverter_current_conf:
+                unit.inverter_current_conf = rawConf
+                payload += self.MapConfig(rawConf, unit.Stamp("QPIRI"), unit.id)
+                syslog.syslog(syslog.LOG_INFO, "send config payload {}".format(payload))
+            if payload:
+                self.Emit(payload)
 
-        return json.loads(inverter_data.decode("utf-8"))
-
-    def MapData(self, data):
-        date = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-        payload = [
-            {
-                "measurement": "battery",
-                "tags": {"id": 1},
-                "time": date,
-                "fields": {
-                    "DC_V": data["battery_voltage"],
-                    "DC_V_scc": data["battery_voltage_from_scc"],
-                    "charging_current": data["battery_charging_current"],
-                    "discharge_current": data["battery_discharge_current"],
-                    "soc": data["battery_capacity"],
-                    "battery_voltage_to_steady_while_charging": data[
-                        "is_battery_voltage_to_steady_while_charging"
-                    ],
-                },
-            },
-            {
-                "measurement": "pv",
-                "tags": {"id": 1},
-                "time": date,
-                "fields": {
-                    "DC_V": data["pv_input_voltage"],
-                    "A": data["pv_input_current_for_battery"],
-                    "W": data["pv_input_power"],
-                },
-            },
-            {
-                "measurement": "grid",
-                "tags": {"id": 1},
-                "time": date,
-                "fields": {
-                    "AC_V": data["ac_input_voltage"],
-                    "Hz": data["ac_input_frequency"],
-                },
-            },
-            {
-                "measurement": "out",
-                "tags": {"id": 1},
-                "time": date,
-                "fields": {
-                    "AC_V": data["ac_output_voltage"],
-                    "Hz": data["ac_output_frequency"],
-                    "load_watt": data["ac_output_active_power"],
-                    "load_percent": data["ac_output_load"],
-                    "load_va": data["ac_output_apparent_power"],
-                },
-            },
-            {
-                "measurement": "inverter",
-                "tags": {"id": 1},
-                "time": date,
-                "fields": {
-                    "bus_voltage": data["bus_voltage"],
-                    "heat_sink_temperature": data["inverter_heat_sink_temperature"],
-                    "load_status_on": data["is_load_on"],
-                    "scc_charge_on": data["is_scc_charging_on"],
-                    "ac_charge_on": data["is_ac_charging_on"],
-                    "charging_on": data["is_charging_on"],
-                    "charging_to_float": data["is_charging_to_float"],
-                    "configuration_changed": data["is_configuration_changed"],
-                    "switched_on": data["is_switched_on"],
-                },
-            },
-        ]
-        return payload
-
-    def MapConfig(self, data):
-        date = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-        payload = [
-            {
-                "measurement": "config",
-                "tags": {"id": 1},
-                "time": date,
-                "fields": {
-                    "ac_input_voltage": data["ac_input_voltage"],
-                    "ac_input_current": data["ac_input_current"],
-                    "ac_output_voltage": data["ac_output_voltage"],
-                    "ac_output_frequency": data["ac_output_frequency"],
-                    "ac_output_apparent_power": data["ac_output_apparent_power"],
-                    "ac_output_active_power": data["ac_output_active_power"],
-                    "battery_voltage": data["battery_voltage"],
-                    "battery_type": data["battery_type"],
-                    "battery_recharge_voltage": data["battery_recharge_voltage"],
-                    "battery_under_voltage": data["battery_under_voltage"],
-                    "battery_bulk_charge_voltage": data["battery_bulk_charge_voltage"],
-                    "battery_float_charge_voltage": data[
-                        "battery_float_charge_voltage"
-                    ],
-                    "battery_redischarge_voltage": data["battery_redischarge_voltage"],
-                    "input_voltage_range": data["input_voltage_range"],
-                    "output_source_priority": data["output_source_priority"],
-                    "charger_source_priority": data["charger_source_priority"],
-                    "max_parallel_units": data["max_parallel_units"],
-                    "max_ac_charging_current": data["max_ac_charging_current"],
-                    "max_charging_current": data["max_charging_current"],
-                    "machine_type": data["machine_type"],
-                    "topology": data["topology"],
-                    "output_mode": data["output_mode"],
-                    "pv_ok_condition": data["pv_ok_condition"],
-                    "pv_power_balance": data["pv_power_balance"],
-                },
-            }
-        ]
-        return payload
-
-    def MapWarning(self, data):
-        date = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-        payload = [
-            {
-                "measurement": "warning",
-                "tags": {"id": 1},
-                "time": date,
-                "fields": {
-                    "bat_open_fault": data["bat_open_fault"],
-                    "battery_low_alarm_warning": data["battery_low_alarm_warning"],
-                    "battery_short_fault": data["battery_short_fault"],
-                    "battery_too_low_to_charge_warning": data[
-                        "battery_too_low_to_charge_warning"
-                    ],
-                    "battery_under_shutdown_warning": data[
-                        "battery_under_shutdown_warning"
-                    ],
-                    "battery_voltage_to_high_fault": data[
-                        "battery_voltage_to_high_fault"
-                    ],
-                    "bus_over_fault": data["bus_over_fault"],
-                    "bus_soft_fail_fault": data["bus_soft_fail_fault"],
-                    "bus_under_fault": data["bus_under_fault"],
-                    "current_sensor_fail_fault": data["current_sensor_fail_fault"],
-                    "eeprom_fault": data["eeprom_fault"],
-                    "fan_locked_fault": data["fan_locked_fault"],
-                    "inverter_fault": data["inverter_fault"],
-                    "inverter_over_current_fault": data["inverter_over_current_fault"],
-                    "inverter_soft_fail_fault": data["inverter_soft_fail_fault"],
-                    "inverter_voltage_too_high_fault": data[
-                        "inverter_voltage_too_high_fault"
-                    ],
-                    "inverter_voltage_too_low_fault": data[
-                        "inverter_voltage_too_low_fault"
-                    ],
-                    "line_fail_warning": data["line_fail_warning"],
-                    "mppt_overload_fault": data["mppt_overload_fault"],
-                    "mppt_overload_warning": data["mppt_overload_warning"],
-                    "op_dc_voltage_over_fault": data["op_dc_voltage_over_fault"],
-                    "opv_short_warning": data["opv_short_warning"],
-                    "over_temperature_fault": data["over_temperature_fault"],
-                    "overload_fault": data["overload_fault"],
-                    "power_limit_warning": data["power_limit_warning"],
-                    "pv_voltage_high_warning": data["pv_voltage_high_warning"],
-                    "reserved": data["reserved"],
-                    "self_test_fail_fault": data["self_test_fail_fault"],
-                },
-            }
-        ]
-        return payload
+    def FlagJob(self, unit, when):
+        rawFlag = unit.PolFlagInverter()
+        with self.lock:
+            self.Emit(self.MapFlag(rawFlag, unit.Stamp("QFLAG"), unit.id))
+
+    def ReportStatsJob(self, when):
+        self.stats.Set("buffered_points", len(self.writer.buffer))
+        self.stats.Set("dropped_points", self.writer.dropped)
+        with self.lock:
+            self.Emit(self.stats.Points(clock.Now()))
+
+    def StatsJob(self, unit, schedule, when):
+        schedule.LogStats()
+        unit.arbiter.LogStats("inverter {}".format(unit.id))
+
+    def RunDevice(self, unit):
+        # every command runs on its own grid, see the schedule config section,
+        # a device entry can override it with its own schedule section
+        schedule_conf = self.ScheduleConf(unit)
+        schedule = scheduler.Scheduler(schedule_conf)
+        schedule.stats = self.stats
+        unit.schedule = schedule
+        schedule.Add("QPIGS", functools.partial(self.DataJob, unit), 1)
+        schedule.Add("QPIWS", functools.partial(self.WarningJob, unit), 1, 0.5)
+        schedule.Add("QPIRI", functools.partial(self.ConfJob, unit), 45 * 60)
+        schedule.Add(
+            "warning_heartbeat",
+            functools.partial(self.WarningHeartbeatJob, unit),
+            30 * 60,
+        )
+        if "QFLAG" in schedule_conf:
+            schedule.Add("QFLAG", functools.partial(self.FlagJob, unit), 60 * 60)
+        schedule.Add("stats", functools.partial(self.StatsJob, unit, schedule), 60 * 60)
+        # nothing is probed before the first sample: QPIGS runs right away,
+        # the first QPIWS tick writes the warnings and the first answered
+        # QPIGS triggers the QPIRI read and the inverter_conf reconcile
+        unit.Reconcile()
+        schedule.Trigger("QPIGS")
+        schedule.Run()
+
+    def RunStats(self):
+        schedule = scheduler.Scheduler({})
+        schedule.Add("influx_writer_stats", self.ReportStatsJob, self.stats.interval)
+        schedule.Run()
 
-    def InfluxWrite(self, payload):
+    def ConfStamp(self):
         try:
-            self.influx_client.write_points(payload)
-            # print("Write points: {0}".format(payload))
-        except influxdb.exceptions.InfluxDBClientError as e:
+            stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def Watch(self):
+        # reload on SIGHUP, and when the config file changes unless
+        # reload.watch_interval is 0
+        stamp = self.ConfStamp()
+        while True:
+            interval = self.conf.get("reload", {}).get("watch_interval", 5)
+            requested = self.reload_requested.wait(interval or None)
+            self.reload_requested.clear()
+            current = self.ConfStamp()
+            if requested or current != stamp:
+                stamp = current
+                try:
+                    self.Reload()
+                except Exception as e:
+                    syslog.syslog(syslog.LOG_ERR, "config reload failed: {}".format(e))
+
+    def StartWatch(self):
+        threading.Thread(target=self.Watch, name="reload", daemon=True).start()
+
+    def Reload(self):
+        # rebuild only the components whose section changed and swap them in
+        # between two samples: the devices with their open handles, their
+        # state and the buffered points are kept, nothing is polled again
+        start = time.monotonic()
+        try:
+            conf = self.LoadConf()
+        except Exception:
+            return False
+        previous = self.conf
+        changed = {
+            key
+            for key in set(previous) | set(conf)
+            if previous.get(key) != conf.get(key)
+        }
+        if not changed:
+            return False
+        restart = [key for key in RESTART_SECTIONS if key in changed]
+        if previous["influx"].get("spool") != conf["influx"].get("spool"):
+            restart.append("influx.spool")
+        unit_confs = device.DeviceConfs(conf)
+        if len(unit_confs) != len(self.devices) or any(
+            Fixed(new) != Fixed(unit.conf)
+            for unit, new in zip(self.devices, unit_confs)
+        ):
+            restart.append("devices")
+        if restart:
             syslog.syslog(
                 syslog.LOG_WARNING,
-                "{} database not found, intempting to create now".format(
-                    self.conf["influx"]["database"]
+                "{} changed, a restart is needed to apply it".format(
+                    ", ".join(restart)
                 ),
             )
-            self.influx_client.create_database(self.conf["influx"]["database"])
-            # print("DB created, writing points: {0}".format(payload))
-            self.influx_client.write_points(payload)
-
-    def Run(self):
-        deadline = datetime.now()
-        now = datetime.now()
-        syslog.syslog(syslog.LOG_INFO, "influx-writer started")
 
-        failCount = 0
+        # everything is built before anything is swapped, a broken section
+        # leaves the running config untouched
+        built = {}
+        write = None
+        reconcilers = {}
+        rates = {}
         try:
-            self.inverter_warning = self.PolWarningInverter()
-            tmp = self.PolConfInverter()
-            for key, value in self.conf["inverter_conf"].items():
-                if key in tmp.items():
-                    tmp[key] = value
-            self.inverter_current_conf = tmp
-            payload = self.MapConfig(self.inverter_current_conf)
-            self.InfluxWrite(payload)
-            payload = self.MapWarning(self.inverter_warning)
-            self.InfluxWrite(payload)
+            if "mapping" in changed:
+                built["mappers"] = mapping.NewMappers(conf.get("mapping", {}))
+            if "filter" in changed:
+                built["change_filter"] = (
+                    changefilter.ChangeFilter(conf["filter"])
+                    if "filter" in conf
+                    else None
+                )
+            if "rollup" in changed:
+                built["rollup"] = (
+                    rollup.Rollup(conf["rollup"]) if "rollup" in conf else None
+                )
+            if "influx" in changed:
+                write, built["influx"] = self.NewInflux(conf["influx"])
+                built["precision"] = conf["influx"].get("precision", "ns")
+                built["encoder"] = lineprotocol.LineEncoder(built["precision"])
+            for unit, new in zip(self.devices, unit_confs):
+                inverter_conf = new.get("inverter_conf", conf["inverter_conf"])
+                if inverter_conf != self.InverterConf(unit):
+                    reconcilers[unit] = reconciler.Reconciler(inverter_conf)
+                if "adaptive" in changed:
+                    rates[unit] = self.NewAdaptive(conf)
         except Exception as e:
-            syslog.syslog(syslog.LOG_ERR, "Failed to poll inverter {}".format(e))
-            failCount += 1
+            syslog.syslog(
+                syslog.LOG_ERR,
+                "config reload failed, keeping the running one: {}".format(e),
+            )
+            return False
 
-        while True:
-            now = datetime.now()
+        if "sinks" in changed:
+            # the old sinks free their ports before the new ones bind them
+            for sink in self.sinks:
+                sink.Close(5)
             try:
-                rawData = self.PolDataInverter()
-                rawWarn = self.PolWarningInverter()
-                failCount = 0
+                built["sinks"] = self.NewSinks(conf.get("sinks", {}))
             except Exception as e:
                 syslog.syslog(
-                    syslog.LOG_ERR, "Failed to poll data from inverter {}".format(e)
+                    syslog.LOG_ERR, "sinks not rebuilt, disabled: {}".format(e)
                 )
-                failCount += 1
+                built["sinks"] = []
 
-            if deadline < now:
-                try:
-                    rawConf = self.PolConfInverter()
-                except Exception as e:
-                    syslog.syslog(
-                        syslog.LOG_ERR,
-                        "Failed to poll config from inverter {}".format(e),
-                    )
-                    failCount += 1
-
-            if failCount == 0:
-                payload = self.MapData(rawData)
-                self.InfluxWrite(payload)
-                if deadline < now:
-                    deadline = deadline + timedelta(minutes=45)
-                    if sorted(self.inverter_current_conf.items()) != sorted(
-                        rawConf.items()
-                    ):
-                        self.ApplyInverterConf()
-                        payload = self.MapConfig(rawConf)
-                        self.InfluxWrite(payload)
-                        syslog.syslog(
-                            syslog.LOG_INFO, "send config payload {}".format(payload)
-                        )
-
-                if (
-                    sorted(self.inverter_warning.items()) != sorted(rawWarn.items())
-                    or now > self.status_timer
-                ):
-                    self.status_timer = now + timedelta(minutes=30)
-                    self.inverter_warning = rawWarn
-                    payload = self.MapWarning(rawWarn)
-                    self.InfluxWrite(payload)
-
-            elif failCount % 10 > 8:
-                syslog.syslog(
-                    syslog.LOG_ERR,
-                    "Inverter polling failed in a {} time in a raw".format(failCount),
-                )
-            time.sleep(1)
+        previous_influx = self.influx
+        with self.lock:
+            for name, value in built.items():
+                setattr(self, name, value)
+            self.writer.Configure(conf["influx"], write)
+            for unit, new in zip(self.devices, unit_confs):
+                for key in RELOADABLE_DEVICE_KEYS:
+                    if key in new:
+                        unit.conf[key] = new[key]
+                    else:
+                        unit.conf.pop(key, None)
+            self.conf = conf
+            for unit, unit_reconciler in reconcilers.items():
+                unit.reconciler = unit_reconciler
+                unit.Reconcile()
+            for unit, rate in rates.items():
+                unit.adaptive = rate
+        if write is not None and hasattr(previous_influx, "Close"):
+            previous_influx.Close()
+
+        for unit in self.devices:
+            if unit.schedule is None:
+                continue
+            schedule_conf = self.ScheduleConf(unit)
+            # back on the configured intervals, an adaptive rate takes over
+            # again from the next sample
+            if schedule_conf != unit.schedule.conf or unit in rates:
+                unit.schedule.Reconfigure(schedule_conf)
+            if unit.ConfDue():
+                unit.schedule.Trigger("QPIRI")
+        for hook in self.reload_hooks:
+            hook()
+        syslog.syslog(
+            syslog.LOG_INFO,
+            "config reloaded in {:.1f}ms, changed: {}".format(
+                (time.monotonic() - start) * 1000, ", ".join(sorted(changed))
+            ),
+        )
+        return True
+
+    def Run(self):
+        syslog.syslog(
+            syslog.LOG_INFO,
+            "influx-writer started with {} inverters".format(len(self.devices)),
+        )
+        # every device is polled from its own thread, they only share the writer
+        threads = [
+            threading.Thread(
+                target=self.RunDevice,
+                args=(unit,),
+                name="inverter-{}".format(unit.id),
+                daemon=True,
+            )
+            for unit in self.devices
+        ]
+        if self.stats is not None:
+            threads.append(
+                threading.Thread(target=self.RunStats, name="stats", daemon=True)
+            )
+        for thread in threads:
+            thread.start()
+        self.StartWatch()
+        for thread in threads:
+            thread.join()
+
+    def RunAsync(self):
+        import asyncio
+        import aiorunner
+
+        self.StartWatch()
+        asyncio.run(aiorunner.AsyncRunner(self).Run())
+
+    def Close(self):
+        self.writer.Close()
+        for sink in self.sinks:
+            sink.Close()
+        if self.snapshot is not None:
+            self.snapshot.Close()
+        for unit in self.devices:
+            unit.Close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--conf", help="path to a config file")
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="poll, map and write from concurrent asyncio tasks",
+    )
     args = parser.parse_args()
 
     inverter = Inverter(args.conf)
-    inverter.Run()
+    signal.signal(signal.SIGHUP, lambda signum, frame: inverter.reload_requested.set())
+    try:
+        if args.use_async:
+            inverter.RunAsync()
+        else:
+            inverter.Run()
+    finally:
+        inverter.Close()
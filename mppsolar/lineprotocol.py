@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+# a point is a plain (measurement, tags, fields, time) tuple, cheaper to build
+# than anything else: tags is a tuple of (key, value) pairs so it can be
+# hashed, fields a flat dict and time an integer in nanoseconds
+
+# write precision -> divisor of the nanosecond stamps and the precision
+# parameter of the influx 1.x and 2.x write endpoints
+PRECISIONS = {
+    "ns": (1, "n", "ns"),
+    "us": (1000, "u", "us"),
+    "ms": (1000000, "ms", "ms"),
+    "s": (1000000000, "s", "s"),
+}
+
+
+def EscapeKey(key):
+    return (
+        str(key)
+        .replace("\\", "\\\\")
+        .replace(",", "\\,")
+        .replace("=", "\\=")
+        .replace(" ", "\\ ")
+    )
+
+
+def EscapeString(value):
+    return '"{}"'.format(value.replace("\\", "\\\\").replace('"', '\\"'))
+
+
+class LineEncoder:
+    # turn points straight into line protocol: measurement and tags prefixes and
+    # field keys are escaped the first time they are seen and cached, each line
+    # is formatted as a single string and appended to a bytearray reused from
+    # one batch to the next. Stamps are truncated to the write precision.
+    def __init__(self, precision="ns"):
+        self.divisor = PRECISIONS[precision][0]
+        self.prefixes = {}
+        self.keys = {}
+        self.buffer = bytearray()
+
+    def Prefix(self, measurement, tags):
+        prefix = (
+            str(measurement)
+            .replace("\\", "\\\\")
+            .replace(",", "\\,")
+            .replace(" ", "\\ ")
+        )
+        for key, value in tags:
+            prefix += ",{}={}".format(EscapeKey(key), EscapeKey(value))
+        prefix = (prefix + " ").encode("utf-8")
+        self.prefixes[(measurement, tags)] = prefix
+        return prefix
+
+    def Key(self, key):
+        escaped = EscapeKey(key) + "="
+        self.keys[key] = escaped
+        return escaped
+
+    def Add(self, point):
+        measurement, tags, fields, time = point
+        keys = self.keys
+        values = []
+        for key, value in fields.items():
+            kind = type(value)
+            if kind is float:
+                if not math.isfinite(value):
+                    continue
+                value = repr(value)
+            elif kind is int:
+                value = "%di" % value
+            elif kind is bool:
+                value = "true" if value else "false"
+            elif kind is str:
+                value = EscapeString(value)
+            elif value is None:
+                continue
+            else:
+                value = EscapeString(str(value))
+            values.append((keys.get(key) or self.Key(key)) + value)
+        if not values:
+            # influx refuses a point without fields
+            return
+        prefix = self.prefixes.get((measurement, tags))
+        if prefix is None:
+            prefix = self.Prefix(measurement, tags)
+        self.buffer += prefix
+        self.buffer += "{} {}\n".format(",".join(values), time // self.divisor).encode(
+            "utf-8"
+        )
+
+    def Encode(self, points):
+        for point in points:
+            self.Add(point)
+        data = bytes(self.buffer)
+        del self.buffer[:]
+        return data
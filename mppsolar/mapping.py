@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+# measurement -> field -> key of the polled response, per kind of poll.
+# A field is either the response key or {"key": ..., "type": ..., "scale": ...}
+DEFAULT_MAPPING = {
+    "data": {
+        "battery": {
+            "DC_V": "battery_voltage",
+            "DC_V_scc": "battery_voltage_from_scc",
+            "charging_current": "battery_charging_current",
+            "discharge_current": "battery_discharge_current",
+            "soc": "battery_capacity",
+            "battery_voltage_to_steady_while_charging": (
+                "is_battery_voltage_to_steady_while_charging"
+            ),
+        },
+        "pv": {
+            "DC_V": "pv_input_voltage",
+            "A": "pv_input_current_for_battery",
+            "W": "pv_input_power",
+        },
+        "grid": {
+            "AC_V": "ac_input_voltage",
+            "Hz": "ac_input_frequency",
+        },
+        "out": {
+            "AC_V": "ac_output_voltage",
+            "Hz": "ac_output_frequency",
+            "load_watt": "ac_output_active_power",
+            "load_percent": "ac_output_load",
+            "load_va": "ac_output_apparent_power",
+        },
+        "inverter": {
+            "bus_voltage": "bus_voltage",
+            "heat_sink_temperature": "inverter_heat_sink_temperature",
+            "load_status_on": "is_load_on",
+            "scc_charge_on": "is_scc_charging_on",
+            "ac_charge_on": "is_ac_charging_on",
+            "charging_on": "is_charging_on",
+            "charging_to_float": "is_charging_to_float",
+            "configuration_changed": "is_configuration_changed",
+            "switched_on": "is_switched_on",
+        },
+    },
+    "config": {
+        "config": {
+            "ac_input_voltage": "ac_input_voltage",
+            "ac_input_current": "ac_input_current",
+            "ac_output_voltage": "ac_output_voltage",
+            "ac_output_frequency": "ac_output_frequency",
+            "ac_output_apparent_power": "ac_output_apparent_power",
+            "ac_output_active_power": "ac_output_active_power",
+            "battery_voltage": "battery_voltage",
+            "battery_type": "battery_type",
+            "battery_recharge_voltage": "battery_recharge_voltage",
+            "battery_under_voltage": "battery_under_voltage",
+            "battery_bulk_charge_voltage": "battery_bulk_charge_voltage",
+            "battery_float_charge_voltage": "battery_float_charge_voltage",
+            "battery_redischarge_voltage": "battery_redischarge_voltage",
+            "input_voltage_range": "input_voltage_range",
+            "output_source_priority": "output_source_priority",
+            "charger_source_priority": "charger_source_priority",
+            "max_parallel_units": "max_parallel_units",
+            "max_ac_charging_current": "max_ac_charging_current",
+            "max_charging_current": "max_charging_current",
+            "machine_type": "machine_type",
+            "topology": "topology",
+            "output_mode": "output_mode",
+            "pv_ok_condition": "pv_ok_condition",
+            "pv_power_balance": "pv_power_balance",
+        },
+    },
+    "warning": {
+        "warning": {
+            "bat_open_fault": "bat_open_fault",
+            "battery_low_alarm_warning": "battery_low_alarm_warning",
+            "battery_short_fault": "battery_short_fault",
+            "battery_too_low_to_charge_warning": "battery_too_low_to_charge_warning",
+            "battery_under_shutdown_warning": "battery_under_shutdown_warning",
+            "battery_voltage_to_high_fault": "battery_voltage_to_high_fault",
+            "bus_over_fault": "bus_over_fault",
+            "bus_soft_fail_fault": "bus_soft_fail_fault",
+            "bus_under_fault": "bus_under_fault",
+            "current_sensor_fail_fault": "current_sensor_fail_fault",
+            "eeprom_fault": "eeprom_fault",
+            "fan_locked_fault": "fan_locked_fault",
+            "inverter_fault": "inverter_fault",
+            "inverter_over_current_fault": "inverter_over_current_fault",
+            "inverter_soft_fail_fault": "inverter_soft_fail_fault",
+            "inverter_voltage_too_high_fault": "inverter_voltage_too_high_fault",
+            "inverter_voltage_too_low_fault": "inverter_voltage_too_low_fault",
+            "line_fail_warning": "line_fail_warning",
+            "mppt_overload_fault": "mppt_overload_fault",
+            "mppt_overload_warning": "mppt_overload_warning",
+            "op_dc_voltage_over_fault": "op_dc_voltage_over_fault",
+            "opv_short_warning": "opv_short_warning",
+            "over_temperature_fault": "over_temperature_fault",
+            "overload_fault": "overload_fault",
+            "power_limit_warning": "power_limit_warning",
+            "pv_voltage_high_warning": "pv_voltage_high_warning",
+            "reserved": "reserved",
+            "self_test_fail_fault": "self_test_fail_fault",
+        },
+    },
+}
+
+
+# measurement -> field -> key of the inverter_poller output, the data of
+# inverterPoller/influx-writer.py
+POLLER_MAPPING = {
+    "data": {
+        "battery": {
+            "DC_V": "Battery_voltage",
+            "DC_V_scc": "SCC_voltage",
+            "charging_current": "Battery_charge_current",
+            "discharge_current": "Battery_discharge_current",
+            "soc": "Battery_capacity",
+            "recharge_voltage": "Battery_recharge_voltage",
+            "under_voltage": "Battery_under_voltage",
+            "bulk_voltage": "Battery_bulk_voltage",
+            "float_voltage": "Battery_float_voltage",
+            "re_discharge_voltage": "Battery_redischarge_voltage",
+        },
+        "pv": {
+            "DC_V": "PV_in_voltage",
+            "A": "PV_in_current",
+            "W": "PV_in_watts",
+            "Wh": "PV_in_watthour",
+        },
+        "grid": {
+            "AC_V": "AC_grid_voltage",
+            "Hz": "AC_grid_frequency",
+            "max_grid_charge_current": "Max_grid_charge_current",
+        },
+        "out": {
+            "AC_V": "AC_out_voltage",
+            "Hz": "AC_out_frequency",
+            "load_watt": "Load_watt",
+            "load_watthour": "Load_watthour",
+            "load_percent": "Load_pct",
+            "load_va": "Load_va",
+        },
+        "inverter": {
+            "bus_voltage": "Bus_voltage",
+            "heat_sink_temperature": "Heatsink_temperature",
+            "max_charge_current": "Max_charge_current",
+            "inverter_mode": "Inverter_mode",
+            "load_status_on": "Load_status_on",
+            "scc_charge_on": "SCC_charge_on",
+            "ac_charge_on": "AC_charge_on",
+            "output_source_priority": "Out_source_priority",
+            "charger_source_priority": "Charger_source_priority",
+        },
+    },
+}
+
+# source of a point in the generated Map: the (measurement, tags, fields,
+# time) tuples of lineprotocol, or the dicts the influxdb client writes
+POINTS = {
+    "tuple": "({name!r}, tags, {{{fields}}}, time)",
+    "dict": '{{"measurement": {name!r}, "tags": tags, "time": time, '
+    '"fields": {{{fields}}}}}',
+}
+
+
+CASTS = {"int": int, "float": float, "bool": bool, "str": str}
+
+
+def Cast(spec):
+    cast = CASTS[spec["type"]] if spec.get("type") is not None else None
+    scale = spec.get("scale")
+    if scale is None:
+        return cast
+    if cast is None:
+        return lambda value: value * scale
+    return lambda value: cast(value * scale)
+
+
+class Mapper:
+    # the mapping is turned once into the source of a function building the
+    # points, so mapping a sample costs no more than hand written literals: no
+    # loop, no lookup of the mapping itself. point is a key of POINTS.
+    def __init__(self, measurements, point="tuple"):
+        casts = {}
+        points = []
+        for name, fields in measurements.items():
+            if not fields:
+                continue
+            values = []
+            for field, spec in fields.items():
+                if isinstance(spec, str):
+                    spec = {"key": spec}
+                value = "data[{!r}]".format(spec["key"])
+                cast = Cast(spec)
+                if cast is not None:
+                    cast_name = "cast_{}".format(len(casts))
+                    casts[cast_name] = cast
+                    value = "{}({})".format(cast_name, value)
+                values.append("{!r}: {}".format(field, value))
+            points.append(POINTS[point].format(name=name, fields=", ".join(values)))
+        source = "def Map(data, time, tags):\n    return [{}]\n".format(
+            ", ".join(points)
+        )
+        namespace = dict(casts)
+        exec(compile(source, "<mapping>", "exec"), namespace)
+        self.source = source
+        self.Map = namespace["Map"]
+
+
+def NewMappers(conf, defaults=DEFAULT_MAPPING, point="tuple"):
+    # the mapping config section is merged over the defaults: a measurement
+    # gets fields added or overridden, a field mapped to null is removed
+    mappers = {}
+    for kind, measurements in defaults.items():
+        merged = {name: dict(fields) for name, fields in measurements.items()}
+        for name, fields in conf.get(kind, {}).items():
+            merged.setdefault(name, {}).update(fields)
+        for fields in merged.values():
+            for field in [field for field, spec in fields.items() if spec is None]:
+                del fields[field]
+        mappers[kind] = Mapper(merged, point)
+    return mappers
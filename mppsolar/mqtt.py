@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import select
+import socket
+import struct
+import time
+
+# just enough MQTT 3.1.1 to publish at QoS 0: CONNECT, PUBLISH, PINGREQ and
+# DISCONNECT, anything the broker sends back after the CONNACK is discarded
+
+
+def String(value):
+    data = value.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+
+def Packet(kind, body):
+    # fixed header: packet type and flags, then the remaining length varint
+    header = bytearray([kind])
+    length = len(body)
+    while True:
+        byte = length % 128
+        length //= 128
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            break
+    return bytes(header) + body
+
+
+class MqttClient:
+    def __init__(self, conf):
+        self.host = conf.get("host", "localhost")
+        self.port = conf.get("port", 1883)
+        self.client_id = conf.get("client_id", "influx-writer")
+        self.username = conf.get("username")
+        self.password = conf.get("password")
+        self.keepalive = conf.get("keepalive", 60)
+        self.timeout = conf.get("timeout", 10)
+        self.sock = None
+        self.last_send = 0
+
+    def Connect(self):
+        flags = 0x02  # clean session
+        payload = String(self.client_id)
+        if self.username is not None:
+            flags |= 0x80
+            payload += String(self.username)
+        if self.password is not None:
+            flags |= 0x40
+            payload += String(self.password)
+        body = String("MQTT") + struct.pack("!BBH", 4, flags, self.keepalive)
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            sock.sendall(Packet(0x10, body + payload))
+            connack = b""
+            while len(connack) < 4:
+                chunk = sock.recv(4 - len(connack))
+                if not chunk:
+                    raise ConnectionError("mqtt broker closed the connection")
+                connack += chunk
+        except OSError as e:
+            sock.close()
+            raise e
+        if connack[0] != 0x20 or connack[3] != 0:
+            sock.close()
+            raise ConnectionError(
+                "mqtt broker refused the connection: {}".format(connack[3])
+            )
+        self.sock = sock
+        self.last_send = time.monotonic()
+
+    def Send(self, packet):
+        if self.sock is None:
+            self.Connect()
+        try:
+            # throw away the PINGRESP and whatever else came in meanwhile
+            while select.select([self.sock], [], [], 0)[0]:
+                if not self.sock.recv(4096):
+                    raise ConnectionError("mqtt broker closed the connection")
+            self.sock.sendall(packet)
+        except OSError as e:
+            self.Drop()
+            raise e
+        self.last_send = time.monotonic()
+
+    def Publish(self, topic, payload, retain=False):
+        self.Send(Packet(0x31 if retain else 0x30, String(topic) + payload))
+
+    def Ping(self):
+        # keep the session alive when nothing got published for a while
+        if self.sock is not None and time.monotonic() - self.last_send > (
+            self.keepalive / 2
+        ):
+            self.Send(Packet(0xC0, b""))
+
+    def Drop(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def Close(self):
+        if self.sock is not None:
+            try:
+                self.sock.sendall(Packet(0xE0, b""))
+            except OSError:
+                pass
+            self.Drop()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+# native PI30 (Axpert) protocol: frames are the ascii command followed by its
+# CRC16/XMODEM and a carriage return, answers are "(" + space separated values
+# + CRC + "\r". Responses are decoded straight into the typed dicts
+# `mppsolar -o json` prints, without going through mppsolar nor json.
+
+import binascii
+import warningmask
+
+# the inverter never sends these bytes in a crc, they are bumped by one
+CRC_RESERVED = (0x28, 0x0D, 0x0A)
+
+
+def Crc(data):
+    # crc_hqx seeded with 0 is CRC16/XMODEM
+    crc = binascii.crc_hqx(data, 0)
+    high, low = crc >> 8, crc & 0xFF
+    if high in CRC_RESERVED:
+        high += 1
+    if low in CRC_RESERVED:
+        low += 1
+    return bytes((high, low))
+
+
+FRAMES = {}
+
+
+def Frame(command):
+    frame = FRAMES.get(command)
+    if frame is None:
+        data = command.encode("ascii")
+        frame = FRAMES[command] = data + Crc(data) + b"\r"
+    return frame
+
+
+def Payload(response):
+    # check the frame and its crc, returns the text between "(" and the crc
+    response = response.rstrip(b"\r")
+    if not response.startswith(b"("):
+        raise ValueError("malformed PI30 response {!r}".format(response[:40]))
+    body, crc = response[:-2], response[-2:]
+    if Crc(body) != crc:
+        raise ValueError("PI30 crc mismatch on {!r}: {!r}".format(response[:40], crc))
+    return body[1:].decode("latin-1")
+
+
+class Option(dict):
+    # enum fields: code -> label, a list is indexed by the number of the code.
+    # The compiled decoders subscript it inline, only a code missing from the
+    # table (zero padded number, unknown value kept as is) costs a call.
+    def __init__(self, options):
+        self.numbered = not isinstance(options, dict)
+        if self.numbered:
+            options = {str(index): label for index, label in enumerate(options)}
+        super().__init__(options)
+
+    def __missing__(self, value):
+        if self.numbered:
+            return self.get(str(int(value)), value)
+        return value
+
+    def __call__(self, value):
+        return self[value]
+
+
+def Flags(*names):
+    # a string of 0/1 characters, one field per character, None skips it
+    return names
+
+
+QPIGS = (
+    ("ac_input_voltage", float),
+    ("ac_input_frequency", float),
+    ("ac_output_voltage", float),
+    ("ac_output_frequency", float),
+    ("ac_output_apparent_power", int),
+    ("ac_output_active_power", int),
+    ("ac_output_load", int),
+    ("bus_voltage", int),
+    ("battery_voltage", float),
+    ("battery_charging_current", int),
+    ("battery_capacity", int),
+    ("inverter_heat_sink_temperature", int),
+    ("pv_input_current_for_battery", int),
+    ("pv_input_voltage", float),
+    ("battery_voltage_from_scc", float),
+    ("battery_discharge_current", int),
+    (
+        Flags(
+            "is_sbu_priority_version_added",
+            "is_configuration_changed",
+            "is_scc_firmware_updated",
+            "is_load_on",
+            "is_battery_voltage_to_steady_while_charging",
+            "is_charging_on",
+            "is_scc_charging_on",
+            "is_ac_charging_on",
+        ),
+        None,
+    ),
+    ("rsv1", int),
+    ("rsv2", int),
+    ("pv_input_power", int),
+    (Flags("is_charging_to_float", "is_switched_on", "is_reserved"), None),
+)
+
+QPIRI = (
+    ("ac_input_voltage", float),
+    ("ac_input_current", float),
+    ("ac_output_voltage", float),
+    ("ac_output_frequency", float),
+    ("ac_output_current", float),
+    ("ac_output_apparent_power", int),
+    ("ac_output_active_power", int),
+    ("battery_voltage", float),
+    ("battery_recharge_voltage", float),
+    ("battery_under_voltage", float),
+    ("battery_bulk_charge_voltage", float),
+    ("battery_float_charge_voltage", float),
+    ("battery_type", Option(["AGM", "Flooded", "User"])),
+    ("max_ac_charging_current", int),
+    ("max_charging_current", int),
+    ("input_voltage_range", Option(["Appliance", "UPS"])),
+    ("output_source_priority", Option(["Utility first", "Solar first", "SBU first"])),
+    (
+        "charger_source_priority",
+        Option(
+            [
+                "Utility first",
+                "Solar first",
+                "Solar + Utility",
+                "Only solar charging permitted",
+            ]
+        ),
+    ),
+    ("max_parallel_units", int),
+    ("machine_type", Option({"00": "Grid tie", "01": "Off Grid", "10": "Hybrid"})),
+    ("topology", Option(["transformerless", "transformer"])),
+    (
+        "output_mode",
+        Option(
+            [
+                "single machine output",
+                "parallel output",
+                "Phase 1 of 3 Phase output",
+                "Phase 2 of 3 Phase output",
+                "Phase 3 of 3 Phase output",
+            ]
+        ),
+    ),
+    ("battery_redischarge_voltage", float),
+    (
+        "pv_ok_condition",
+        Option(
+            [
+                "As long as one unit of inverters has connect PV, parallel system will consider PV OK",
+                "Only All of inverters have connect PV, parallel system will consider PV OK",
+            ]
+        ),
+    ),
+    (
+        "pv_power_balance",
+        Option(
+            [
+                "PV input max current will be the max charged current",
+                "PV input max power will be the sum of the max charged power and loads power",
+            ]
+        ),
+    ),
+)
+
+QFLAG_NAMES = {
+    "a": "buzzer",
+    "b": "overload_bypass",
+    "j": "power_saving",
+    "k": "lcd_reset_to_default",
+    "u": "overload_restart",
+    "v": "over_temperature_restart",
+    "x": "lcd_backlight",
+    "y": "primary_source_interrupt_alarm",
+    "z": "record_fault_code",
+}
+
+
+def Fields(spec):
+    # compile the decoder of a space separated answer, like mapping.Mapper
+    # does: one literal dict, no loop over the spec. Shorter answers fall back
+    # to a loop keeping the fields present, extra trailing values some
+    # firmwares add are ignored.
+    casts = {}
+    values = []
+    flags = []
+    for index, (name, cast) in enumerate(spec):
+        if cast is None:
+            flags.append("    f{0} = v[{0}]\n".format(index))
+            for bit, flag in enumerate(name):
+                if flag is not None:
+                    values.append(
+                        '{!r}: 1 if f{}[{}:{}] == "1" else 0'.format(
+                            flag, index, bit, bit + 1
+                        )
+                    )
+            continue
+        if cast in (int, float):
+            values.append("{!r}: {}(v[{}])".format(name, cast.__name__, index))
+            continue
+        cast_name = "cast_{}".format(len(casts))
+        casts[cast_name] = cast
+        if isinstance(cast, Option):
+            values.append("{!r}: {}[v[{}]]".format(name, cast_name, index))
+        else:
+            values.append("{!r}: {}(v[{}])".format(name, cast_name, index))
+    source = (
+        "def Decode(payload):\n"
+        "    v = payload.split()\n"
+        "    if len(v) < {}:\n"
+        "        return Partial(v)\n"
+        "{}"
+        "    return {{{}}}\n"
+    ).format(len(spec), "".join(flags), ", ".join(values))
+
+    def Partial(fields):
+        response = {}
+        for (name, cast), value in zip(spec, fields):
+            if cast is not None:
+                response[name] = cast(value)
+                continue
+            for flag, bit in zip(name, value):
+                if flag is not None:
+                    response[flag] = 1 if bit == "1" else 0
+        return response
+
+    # int and float found in the globals of Decode, not looked up in builtins
+    namespace = dict(casts, Partial=Partial, int=int, float=float)
+    exec(compile(source, "<pi30>", "exec"), namespace)
+    return namespace["Decode"]
+
+
+def DecodeWarnings(payload):
+    # a single integer, see warningmask: the field per warning is only built
+    # when the warning measurement is written
+    return {"warning_mask": warningmask.Parse(payload.strip())}
+
+
+def DecodeFlag(payload):
+    response = {}
+    state = "enabled"
+    for char in payload:
+        if char == "E":
+            state = "enabled"
+        elif char == "D":
+            state = "disabled"
+        elif char in QFLAG_NAMES:
+            response[QFLAG_NAMES[char]] = state
+    return response
+
+
+DECODERS = {
+    "QPIGS": Fields(QPIGS),
+    "QPIRI": Fields(QPIRI),
+    "QPIWS": DecodeWarnings,
+    "QFLAG": DecodeFlag,
+}
+
+
+def Decode(command, response):
+    payload = Payload(response)
+    decoder = DECODERS.get(command)
+    if payload in ("ACK", "NAK"):
+        if decoder is not None:
+            return {"validity_check": "{} answered {}".format(command, payload)}
+        return {command.lower(): payload}
+    if decoder is None:
+        return {command.lower(): payload}
+    return decoder(payload)
+
+
+# frames recorded on an Axpert MKS 5kVA, they decode to transport.FAKE_RESPONSES
+FIXTURES = {
+    "QPIGS": b"(231.4 49.9 230.1 50.0 0552 0498 011 392 52.60 012 087 0038 0007 "
+    b"118.4 52.61 00000 00010110 00 00 00829 0107K\r",
+    "QPIRI": b"(230.0 21.7 230.0 50.0 21.7 5000 5000 48.0 46.0 42.0 56.4 54.0 1 30 "
+    b"060 0 1 1 9 01 0 0 54.0 0 1 000\x0e\xdf\r",
+    "QPIWS": b"(00000000000000000000000000000000\xeb\xe4\r",
+    "QFLAG": b"(EakuvxyzDbj\x0b\xda\r",
+    "PBT01": b"(ACK9 \r",
+}
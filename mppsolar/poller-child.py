@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import sys
+import transport
+
+# long lived poller meant to run inside the mppsolar venv: every line read on
+# stdin is an inverter command, answered by a single json line on stdout.
+# With -c it answers that one command and exits, like the mppsolar cli does.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--port", default="/dev/hidraw0")
+    parser.add_argument("--protocol", default="PI30")
+    parser.add_argument(
+        "--transport", default="hidraw", help="fake turns it into a stub poller"
+    )
+    parser.add_argument("-c", "--command", help="answer a single command and exit")
+    parser.add_argument(
+        "--latency", type=float, default=0, help="fake inverter answer delay"
+    )
+    parser.add_argument(
+        "--failure-ratio", type=float, default=0, help="fake inverter timeouts"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0, help="fake inverter value drift"
+    )
+    args = parser.parse_args()
+
+    link = transport.NewTransport(
+        {
+            "transport": args.transport,
+            "port": args.port,
+            "protocol": args.protocol,
+            "latency": args.latency,
+            "failure_ratio": args.failure_ratio,
+            "jitter": args.jitter,
+        }
+    )
+    commands = [args.command] if args.command else sys.stdin
+    for line in commands:
+        command = line.strip()
+        if not command:
+            continue
+        try:
+            response = link.Send(command)
+        except Exception as e:
+            response = {"error": str(e)}
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+    link.Close()
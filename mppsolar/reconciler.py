@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import syslog
+
+# inverter_conf key -> QPIRI field it is read back from and the setting
+# command of every value
+SETTINGS = {
+    "battery_type": (
+        "battery_type",
+        {"AGM": "PBT00", "Flooded": "PBT01", "User": "PBT02"},
+    ),
+    "charger_source_priority": (
+        "charger_source_priority",
+        {
+            "Utility first": "PCP00",
+            "Solar first": "PCP01",
+            "Solar + Utility": "PCP02",
+            "Only solar charging permitted": "PCP03",
+        },
+    ),
+    "output_source_priority": (
+        "output_source_priority",
+        {"Utility first": "POP00", "Solar first": "POP01", "SBU first": "POP02"},
+    ),
+}
+
+# the example config always called it that way
+ALIASES = {"device_charger_priority": "charger_source_priority"}
+
+# inverter_conf key -> QFLAG field and the letter of the PE/PD commands
+FLAGS = {
+    "buzzer": "a",
+    "overload_bypass": "b",
+    "power_saving": "j",
+    "overload_restart": "u",
+    "over_temperature_restart": "v",
+}
+
+
+def Same(wanted, current):
+    return str(wanted).lower() == str(current).lower()
+
+
+def Acked(response):
+    # transports answer {"<command>": "ACK"} or the list mppsolar prints
+    for value in response.values():
+        if isinstance(value, list):
+            value = value[0] if value else ""
+        if value == "NAK":
+            return False
+    return True
+
+
+class Reconciler:
+    # bring the inverter to inverter_conf with as few EEPROM writes as
+    # possible: the settings are compared with the QPIRI (and QFLAG) answers,
+    # only the ones that differ are sent, the flags to change are gathered in
+    # a single PE and a single PD command, and one read back checks them
+    def __init__(self, inverter_conf):
+        self.settings = {}
+        self.flags = {}
+        for key, value in inverter_conf.items():
+            key = ALIASES.get(key, key)
+            if key in SETTINGS:
+                field, commands = SETTINGS[key]
+                command = next(
+                    (
+                        command
+                        for name, command in commands.items()
+                        if Same(name, value)
+                    ),
+                    None,
+                )
+                if command is None:
+                    syslog.syslog(
+                        syslog.LOG_WARNING,
+                        "{} value not supported: {}".format(key, value),
+                    )
+                    continue
+                self.settings[key] = (field, value, command)
+            elif key in FLAGS:
+                self.flags[key] = bool(value)
+            else:
+                syslog.syslog(
+                    syslog.LOG_WARNING,
+                    "inverter_conf key not supported: {}".format(key),
+                )
+
+    def Diff(self, rawConf, rawFlag=None):
+        # setting key -> wanted value of the ones the inverter does not match
+        diff = {}
+        for key, (field, value, command) in self.settings.items():
+            if not Same(value, rawConf.get(field)):
+                diff[key] = value
+        if rawFlag is not None:
+            for key, enabled in self.flags.items():
+                if (rawFlag.get(key) == "enabled") != enabled:
+                    diff[key] = enabled
+        return diff
+
+    def Commands(self, diff):
+        commands = [self.settings[key][2] for key in diff if key in self.settings]
+        enable = "".join(FLAGS[key] for key in diff if key in FLAGS and diff[key])
+        disable = "".join(FLAGS[key] for key in diff if key in FLAGS and not diff[key])
+        if enable:
+            commands.append("PE" + enable)
+        if disable:
+            commands.append("PD" + disable)
+        return commands
+
+    def ReadFlags(self, send):
+        # None when QFLAG fails, some firmwares answer it NAK
+        try:
+            return send("QFLAG")
+        except Exception as e:
+            syslog.syslog(
+                syslog.LOG_ERR,
+                "QFLAG read failed, the flags are not reconciled: {}".format(e),
+            )
+            return None
+
+    def Apply(self, send, rawConf):
+        # returns the configuration read back and the fields of the attempt,
+        # None when there was nothing to do. Without a QFLAG answer only the
+        # QPIRI settings are reconciled, the flags are a failed attempt.
+        rawFlag = self.ReadFlags(send) if self.flags else None
+        unread = sorted(self.flags) if rawFlag is None else []
+        diff = self.Diff(rawConf, rawFlag)
+        if not diff and not unread:
+            return rawConf, None
+        commands = self.Commands(diff)
+        refused = ["QFLAG"] if unread else []
+        if not commands:
+            return rawConf, {
+                "changed": "",
+                "commands": "",
+                "refused": ",".join(refused),
+                "mismatch": ",".join(unread),
+                "ok": False,
+            }
+        for command in commands:
+            try:
+                if not Acked(send(command)):
+                    refused.append(command)
+            except Exception as e:
+                syslog.syslog(
+                    syslog.LOG_ERR, "{} setting failed: {}".format(command, e)
+                )
+                refused.append(command)
+        try:
+            rawConf = send("QPIRI")
+        except Exception as e:
+            # the settings sent are then reported as mismatching
+            syslog.syslog(syslog.LOG_ERR, "QPIRI read back failed: {}".format(e))
+        rawFlag = None
+        if any(key in FLAGS for key in diff):
+            rawFlag = self.ReadFlags(send)
+            if rawFlag is None:
+                unread = [key for key in diff if key in FLAGS]
+        left = self.Diff(rawConf, rawFlag)
+        left = [key for key in diff if key in left and key not in unread]
+        left += unread
+        syslog.syslog(
+            syslog.LOG_INFO,
+            "applied inverter settings {} with {}, {} still differ".format(
+                sorted(diff), commands, left
+            ),
+        )
+        return rawConf, {
+            "changed": ",".join(sorted(diff)),
+            "commands": ",".join(commands),
+            "refused": ",".join(refused),
+            "mismatch": ",".join(left),
+            "ok": not refused and not left,
+        }
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import adaptive
+
+
+def Label(window):
+    if window % 3600 == 0:
+        return "{}h".format(window // 3600)
+    if window % 60 == 0:
+        return "{}m".format(window // 60)
+    return "{}s".format(window)
+
+
+class Rollup:
+    # streaming aggregates of the data points over fixed windows of the wall
+    # clock. Every numeric field keeps a running count, sum, min, max and last
+    # value per window, power fields listed in energy are integrated with the
+    # trapezoidal rule into Wh. When a point falls in a new window the previous
+    # one is emitted as <measurement>_<window> stamped with the window start,
+    # e.g. pv_1m with W_mean, W_min, W_max, W_last, count and Wh.
+    def __init__(self, conf):
+        self.windows = [
+            (window * 1000000000, Label(window))
+            for window in conf.get("windows", [60, 900])
+        ]
+        self.measurements = conf.get("measurements")
+        self.energy = conf.get(
+            "energy", {"pv": {"W": "Wh"}, "out": {"load_watt": "Wh"}}
+        )
+        # samples further apart than max_gap seconds are not integrated
+        self.max_gap = conf.get("max_gap", 60) * 1000000000
+        # raw points are kept once every raw_interval seconds, all of them
+        # without it and none with "raw": false
+        self.raw = conf.get("raw", True)
+        self.raw_interval = conf.get("raw_interval", 0) * 1000000000
+        self.windows_state = {}
+        self.last = {}
+        self.raw_next = {}
+
+    def Accumulate(self, fields, values, energy):
+        for field, value in values.items():
+            if type(value) not in (int, float):
+                continue
+            acc = fields.get(field)
+            if acc is None:
+                fields[field] = [1, value, value, value, value]
+                continue
+            acc[0] += 1
+            acc[1] += value
+            if value < acc[2]:
+                acc[2] = value
+            elif value > acc[3]:
+                acc[3] = value
+            acc[4] = value
+        for name, wh in energy.items():
+            fields[name] = fields.get(name, 0.0) + wh
+
+    def Point(self, measurement, label, tags, start, fields):
+        values = {}
+        count = 0
+        for field, acc in fields.items():
+            if type(acc) is float:
+                values[field] = round(acc, 6)
+                continue
+            count = max(count, acc[0])
+            values[field + "_mean"] = acc[1] / acc[0]
+            values[field + "_min"] = acc[2]
+            values[field + "_max"] = acc[3]
+            values[field + "_last"] = acc[4]
+        values["count"] = count
+        return ("{}_{}".format(measurement, label), tags, values, start)
+
+    def Energy(self, measurement, tags, values, time):
+        # Wh of every power field since the previous sample of the series
+        energy = self.energy.get(measurement)
+        if not energy:
+            return {}
+        key = (measurement, tags)
+        previous = self.last.get(key)
+        self.last[key] = (values, time)
+        if previous is None or not 0 < time - previous[1] <= self.max_gap:
+            return {}
+        hours = (time - previous[1]) / 3.6e12
+        wh = {}
+        for field, name in energy.items():
+            value = values.get(field)
+            last = previous[0].get(field)
+            if type(value) in (int, float) and type(last) in (int, float):
+                wh[name] = (value + last) / 2 * hours
+        return wh
+
+    def Add(self, points):
+        # returns the raw points still to be written and the closed windows
+        out = []
+        for point in points:
+            measurement, tags, values, time = point
+            # the windows and energy integrals span the rate changes of an
+            # adaptive device, its rollup points carry no interval tag
+            tags = adaptive.Series(tags)
+            if self.measurements is not None and measurement not in self.measurements:
+                out.append(point)
+                continue
+            if self.raw:
+                due = self.raw_next.get((measurement, tags), 0)
+                if time >= due:
+                    out.append(point)
+                    if self.raw_interval:
+                        self.raw_next[(measurement, tags)] = (
+                            time // self.raw_interval + 1
+                        ) * self.raw_interval
+            energy = self.Energy(measurement, tags, values, time)
+            for window, label in self.windows:
+                start = time - time % window
+                key = (window, measurement, tags)
+                state = self.windows_state.get(key)
+                if state is None or state[0] != start:
+                    if state is not None and state[1]:
+                        out.append(
+                            self.Point(measurement, label, tags, state[0], state[1])
+                        )
+                    state = self.windows_state[key] = [start, {}]
+                self.Accumulate(state[1], values, energy)
+        return out
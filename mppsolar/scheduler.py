@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import math
+import syslog
+import time
+
+
+class Job:
+    def __init__(self, name, action, interval, phase, missed, first):
+        self.name = name
+        self.action = action
+        self.interval = interval
+        self.phase = phase
+        self.missed = missed
+        self.next = first
+        self.runs = 0
+        self.skipped = 0
+        self.jitter = collections.deque(maxlen=1000)
+        self.max_jitter = 0
+
+    def Stats(self):
+        jitter = sorted(self.jitter) or [0]
+        return {
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "jitter_mean": sum(jitter) / len(jitter),
+            "jitter_p95": jitter[min(len(jitter) - 1, int(len(jitter) * 0.95))],
+            "jitter_max": self.max_jitter,
+        }
+
+
+class Scheduler:
+    # run every job on its own fixed grid of the monotonic clock: the period does
+    # not stretch with the time the jobs take and late ticks are either skipped
+    # or caught up. The grid is anchored on the wall clock once, so ticks fall on
+    # round wall clock times, the samples are stamped when the device answers.
+    def __init__(self, conf):
+        self.conf = conf
+        self.missed = conf.get("missed", "skip")
+        self.mono_anchor = time.monotonic()
+        self.wall_anchor = time.time()
+        self.jobs = []
+        self.stats = None
+        # set from other threads, applied by the scheduler thread between ticks
+        self.pending = None
+        self.triggered = set()
+
+    def Wall(self, mono):
+        return self.wall_anchor + mono - self.mono_anchor
+
+    def Mono(self, wall):
+        return self.mono_anchor + wall - self.wall_anchor
+
+    def Add(self, name, action, interval, phase=0):
+        job = Job(name, action, interval, phase, self.missed, 0)
+        job.defaults = (interval, phase)
+        self.Place(job)
+        self.jobs.append(job)
+        return job
+
+    def Place(self, job):
+        # the config section named after the job overrides the defaults, the
+        # job then waits for the next tick of its grid
+        job_conf = self.conf.get(job.name, {})
+        job.interval = job_conf.get("interval", job.defaults[0])
+        job.phase = job_conf.get("phase", job.defaults[1])
+        job.missed = job_conf.get("missed", self.missed)
+        wall = self.Wall(time.monotonic())
+        first = math.ceil((wall - job.phase) / job.interval) * job.interval + job.phase
+        job.next = self.Mono(first)
+
+    def Reconfigure(self, conf):
+        # new intervals and phases, taken before the next tick
+        self.pending = conf
+
+    def Trigger(self, name):
+        # run the job right away, then back on its grid
+        self.triggered.add(name)
+
+    def SetInterval(self, name, interval):
+        # from a job of this scheduler, e.g. the adaptive QPIGS rate: the job
+        # runs every interval seconds, its next tick is pulled in when later
+        for job in self.jobs:
+            if job.name == name:
+                job.interval = interval
+                job.next = min(job.next, time.monotonic() + interval)
+
+    def Apply(self):
+        conf, self.pending = self.pending, None
+        if conf is not None:
+            self.conf = conf
+            self.missed = conf.get("missed", "skip")
+            for job in self.jobs:
+                self.Place(job)
+        while self.triggered:
+            name = self.triggered.pop()
+            for job in self.jobs:
+                if job.name == name:
+                    job.next = min(job.next, time.monotonic())
+
+    def RunJob(self, job):
+        jitter = time.monotonic() - job.next
+        job.jitter.append(jitter)
+        job.max_jitter = max(job.max_jitter, jitter)
+        if self.stats is not None:
+            self.stats.Record("jitter_{}".format(job.name), jitter)
+        try:
+            job.action(self.Wall(job.next))
+        except Exception as e:
+            syslog.syslog(syslog.LOG_ERR, "{} job failed: {}".format(job.name, e))
+        job.runs += 1
+        job.next += job.interval
+        now = time.monotonic()
+        if job.missed == "skip" and job.next <= now:
+            late = math.floor((now - job.next) / job.interval) + 1
+            job.skipped += late
+            job.next += late * job.interval
+
+    def RunPending(self):
+        # due jobs run oldest tick first, returns the time left until the next one
+        if self.pending is not None or self.triggered:
+            self.Apply()
+        while True:
+            now = time.monotonic()
+            due = [job for job in self.jobs if job.next <= now]
+            if not due:
+                break
+            self.RunJob(min(due, key=lambda job: job.next))
+        return max(0, min(job.next for job in self.jobs) - time.monotonic())
+
+    def Run(self):
+        while True:
+            time.sleep(self.RunPending())
+
+    def Stats(self):
+        return {job.name: job.Stats() for job in self.jobs}
+
+    def LogStats(self, when=None):
+        for name, stats in self.Stats().items():
+            syslog.syslog(
+                syslog.LOG_INFO,
+                "{} runs={} skipped={} jitter mean={:.1f}ms p95={:.1f}ms max={:.1f}ms".format(
+                    name,
+                    stats["runs"],
+                    stats["skipped"],
+                    stats["jitter_mean"] * 1000,
+                    stats["jitter_p95"] * 1000,
+                    stats["jitter_max"] * 1000,
+                ),
+            )
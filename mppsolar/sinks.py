@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import http.server
+import json
+import os
+import re
+import syslog
+import threading
+import adaptive
+import lineprotocol
+import mqtt
+
+
+class SinkThread:
+    # every sink gets its own thread and bounded queue: a slow or dead sink
+    # drops its own oldest points and never blocks the pollers nor the others
+    def __init__(self, name, sink, conf):
+        self.name = name
+        self.sink = sink
+        self.queue = collections.deque(maxlen=conf.get("queue_size", 10000))
+        self.idle = conf.get("idle_interval", 10)
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(
+            target=self.Loop, name="sink-{}".format(name), daemon=True
+        )
+        self.thread.start()
+
+    def Add(self, points):
+        with self.cond:
+            overflow = len(self.queue) + len(points) - self.queue.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+                syslog.syslog(
+                    syslog.LOG_WARNING,
+                    "{} sink queue full, dropped {} points".format(
+                        self.name, self.dropped
+                    ),
+                )
+            self.queue.extend(points)
+            self.cond.notify()
+
+    def Loop(self):
+        while True:
+            with self.cond:
+                if not self.queue and not self.closed:
+                    self.cond.wait(self.idle)
+                if self.closed and not self.queue:
+                    break
+                batch = list(self.queue)
+                self.queue.clear()
+            try:
+                if batch:
+                    self.sink.Write(batch)
+                else:
+                    self.sink.Idle()
+            except Exception as e:
+                syslog.syslog(
+                    syslog.LOG_ERR,
+                    "{} sink failed on {} points: {}".format(self.name, len(batch), e),
+                )
+        self.sink.Close()
+
+    def Close(self, timeout=None):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+
+
+class MqttSink:
+    # publish every point as a json object of its fields on
+    # <prefix>/<measurement>/<tag values>, e.g. influx-writer/battery/1. The
+    # interval tag of an adaptive rate is left out, the topic stays the same
+    # whatever the rate
+    def __init__(self, conf):
+        self.client = mqtt.MqttClient(conf)
+        self.prefix = conf.get("prefix", "influx-writer")
+        self.retain = conf.get("retain", True)
+        self.topics = {}
+
+    def Topic(self, measurement, tags):
+        topic = "/".join(
+            [self.prefix, measurement]
+            + [str(value) for key, value in adaptive.Series(tags)]
+        )
+        self.topics[(measurement, tags)] = topic
+        return topic
+
+    def Write(self, points):
+        for measurement, tags, fields, time_ns in points:
+            topic = self.topics.get((measurement, tags)) or self.Topic(
+                measurement, tags
+            )
+            self.client.Publish(topic, json.dumps(fields).encode("utf-8"), self.retain)
+
+    def Idle(self):
+        self.client.Ping()
+
+    def Close(self):
+        self.client.Close()
+
+
+class PrometheusSink:
+    # keep the latest value of every numeric field and serve them as gauges on
+    # /metrics: <prefix>_<measurement>_<field>{<tags>} <value>, one gauge
+    # per series whatever the adaptive rate it was sampled at
+    def __init__(self, conf):
+        self.prefix = conf.get("prefix", "inverter")
+        self.values = {}
+        self.names = {}
+        self.lock = threading.Lock()
+        sink = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.Render()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(
+            (conf.get("host", ""), conf.get("port", 9110)), Handler
+        )
+        self.server.daemon_threads = True
+        threading.Thread(
+            target=self.server.serve_forever, name="prometheus", daemon=True
+        ).start()
+
+    def Name(self, measurement, tags, field):
+        name = re.sub(
+            "[^a-zA-Z0-9_]", "_", "{}_{}_{}".format(self.prefix, measurement, field)
+        )
+        labels = ",".join(
+            '{}="{}"'.format(
+                re.sub("[^a-zA-Z0-9_]", "_", str(key)),
+                str(value).replace("\\", "\\\\").replace('"', '\\"'),
+            )
+            for key, value in adaptive.Series(tags)
+        )
+        series = "{}{{{}}}".format(name, labels) if labels else name
+        self.names[(measurement, tags, field)] = series
+        return series
+
+    def Write(self, points):
+        names = self.names
+        with self.lock:
+            for measurement, tags, fields, time_ns in points:
+                for field, value in fields.items():
+                    if type(value) not in (int, float, bool):
+                        continue
+                    series = names.get((measurement, tags, field)) or self.Name(
+                        measurement, tags, field
+                    )
+                    self.values[series] = value
+
+    def Render(self):
+        with self.lock:
+            lines = [
+                "{} {}\n".format(series, float(value))
+                for series, value in self.values.items()
+            ]
+        return "".join(sorted(lines)).encode("utf-8")
+
+    def Idle(self):
+        pass
+
+    def Close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FileSink:
+    # append line protocol to path, rotated to path.1 ... path.<backups> once
+    # it grows over max_bytes
+    def __init__(self, conf):
+        self.path = conf["path"]
+        self.max_bytes = conf.get("max_bytes", 64 * 1024 * 1024)
+        self.backups = conf.get("backups", 5)
+        self.encoder = lineprotocol.LineEncoder()
+        self.file = open(self.path, "ab")
+
+    def Rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = "{}.{}".format(self.path, index)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(self.path, index + 1))
+        if self.backups:
+            os.replace(self.path, "{}.1".format(self.path))
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "ab")
+
+    def Write(self, points):
+        self.file.write(self.encoder.Encode(points))
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self.Rotate()
+
+    def Idle(self):
+        pass
+
+    def Close(self):
+        self.file.close()
+
+
+SINKS = {
+    "mqtt": MqttSink,
+    "prometheus": PrometheusSink,
+    "file": FileSink,
+}
+
+
+def NewSinks(conf):
+    # the sinks section lists the outputs fed next to influx, by kind
+    return [
+        SinkThread(kind, SINKS[kind](sink_conf), sink_conf)
+        for kind, sink_conf in conf.items()
+    ]
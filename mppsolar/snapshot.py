@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import grp
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+
+
+def SocketMode(mode):
+    # the octal digits of a mode, as a string ("660") or a json number (660)
+    try:
+        value = int(str(mode), 8)
+    except ValueError:
+        value = -1
+    if not 0 <= value <= 0o777:
+        raise ValueError(
+            'snapshot.socket_mode must be octal digits like "660", not {!r}'.format(
+                mode
+            )
+        )
+    return value
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    # the socket is rw for its owner and group only, the group (a name or a
+    # gid) lets the local tools in without opening it to every user
+    daemon_threads = True
+
+    def __init__(self, path, handler, mode=0o660, group=None):
+        self.mode = mode
+        self.group = group
+        socketserver.ThreadingUnixStreamServer.__init__(self, path, handler)
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.ThreadingUnixStreamServer.server_bind(self)
+        if self.group is not None:
+            gid = self.group
+            if isinstance(gid, str):
+                gid = grp.getgrnam(gid).gr_gid
+            os.chown(self.server_address, -1, gid)
+        os.chmod(self.server_address, self.mode)
+
+
+class SnapshotServer:
+    # serve the last answer of every command of every device, so local tools
+    # read the inverter through the writer instead of opening the device too:
+    #   GET /                           every device
+    #   GET /<id>                       every command of a device
+    #   GET /<id>/<command>             {"time": ..., "age": ..., "data": {...}}
+    #   GET /<id>/<command>/<field>     the bare value
+    #   GET /<id>/arbiter               counters of the device command queue
+    #   GET /stats                      stage timings, with the stats section
+    # over http on host:port and/or on a unix socket. Responses are encoded
+    # once per new answer, a read only formats the age around them.
+    def __init__(self, devices, conf, stats=None):
+        self.devices = {str(unit.id): unit for unit in devices}
+        self.stats = stats
+        self.encoded = {}
+        self.servers = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # buffered, headers and body leave in a single send instead of
+            # the body waiting on the ack of the headers
+            wbufsize = -1
+
+            def do_GET(self):
+                status, body = server.Get(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def address_string(self):
+                # unix socket peers have no address
+                return str(self.client_address or "unix")
+
+            def log_message(self, format, *args):
+                pass
+
+        if "port" in conf:
+            tcp = http.server.ThreadingHTTPServer(
+                (conf.get("host", "127.0.0.1"), conf["port"]), Handler
+            )
+            tcp.daemon_threads = True
+            self.servers.append(tcp)
+        if "socket" in conf:
+            self.servers.append(
+                UnixHTTPServer(
+                    conf["socket"],
+                    Handler,
+                    SocketMode(conf.get("socket_mode", "660")),
+                    conf.get("socket_group"),
+                )
+            )
+        for listener in self.servers:
+            threading.Thread(
+                target=listener.serve_forever, name="snapshot", daemon=True
+            ).start()
+
+    def Entry(self, unit, command):
+        entry = unit.responses.get(command)
+        if entry is None:
+            return None
+        cached = self.encoded.get((unit.id, command))
+        if cached is None or cached[0] is not entry:
+            cached = (entry, json.dumps(entry[0]))
+            self.encoded[(unit.id, command)] = cached
+        return '{{"time": {:.3f}, "age": {:.3f}, "data": {}}}'.format(
+            entry[1] / 1e9, time.monotonic() - entry[2], cached[1]
+        )
+
+    def Device(self, unit):
+        return "{{{}}}".format(
+            ", ".join(
+                '"{}": {}'.format(command, self.Entry(unit, command))
+                for command in list(unit.responses)
+            )
+        )
+
+    def Get(self, path):
+        parts = [part for part in path.split("?")[0].split("/") if part]
+        if not parts:
+            body = "{{{}}}".format(
+                ", ".join(
+                    '"{}": {}'.format(device_id, self.Device(unit))
+                    for device_id, unit in self.devices.items()
+                )
+            )
+            return 200, body.encode("utf-8")
+        if parts == ["stats"] and self.stats is not None:
+            return 200, json.dumps(self.stats.Snapshot()).encode("utf-8")
+        unit = self.devices.get(parts[0])
+        if unit is None or len(parts) > 3:
+            return 404, b'{"error": "not found"}'
+        if len(parts) == 1:
+            return 200, self.Device(unit).encode("utf-8")
+        if parts[1] == "arbiter":
+            return 200, json.dumps(unit.arbiter.Stats()).encode("utf-8")
+        entry = self.Entry(unit, parts[1])
+        if entry is None:
+            return 404, b'{"error": "no answer yet"}'
+        if len(parts) == 2:
+            return 200, entry.encode("utf-8")
+        response = unit.responses[parts[1]][0]
+        if parts[2] not in response:
+            return 404, b'{"error": "no such field"}'
+        return 200, json.dumps(response[parts[2]]).encode("utf-8")
+
+    def Close(self):
+        for listener in self.servers:
+            listener.shutdown()
+            listener.server_close()
+            if isinstance(listener, UnixHTTPServer):
+                os.remove(listener.server_address)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import os
+import syslog
+import threading
+import time
+
+
+class Spool:
+    # append only line protocol files, rotated every segment_size bytes, used to
+    # keep the points influx refused and replay them in order later on
+    def __init__(self, conf):
+        self.path = conf["path"]
+        self.segment_size = conf.get("segment_size", 8 * 1024 * 1024)
+        self.max_size = conf.get("max_size", 512 * 1024 * 1024)
+        self.fsync_every = conf.get("fsync_every", 16)
+        self.fsync_interval = conf.get("fsync_interval", 5)
+        self.replay_chunk = conf.get("replay_chunk", 1024 * 1024)
+        self.lock = threading.Lock()
+        self.current = None
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self.evicted = 0
+        self.offsets = {}
+
+        os.makedirs(self.path, exist_ok=True)
+        self.segments = sorted(
+            int(name[:-3]) for name in os.listdir(self.path) if name.endswith(".lp")
+        )
+        self.sizes = {
+            seq: os.path.getsize(self.SegmentPath(seq)) for seq in self.segments
+        }
+
+    def SegmentPath(self, seq):
+        return os.path.join(self.path, "{:020d}.lp".format(seq))
+
+    def Size(self):
+        return sum(self.sizes.values())
+
+    def Empty(self):
+        return not self.segments
+
+    def Append(self, data):
+        with self.lock:
+            if (
+                self.current is None
+                or self.sizes[self.segments[-1]] >= self.segment_size
+            ):
+                self.Rotate()
+            self.current.write(data)
+            self.sizes[self.segments[-1]] += len(data)
+            self.pending += 1
+            # fsync in batches, a crash loses at most the last few appends
+            if (
+                self.pending >= self.fsync_every
+                or time.monotonic() - self.last_sync >= self.fsync_interval
+            ):
+                self.Sync()
+            self.Evict()
+
+    def Rotate(self):
+        self.Seal()
+        seq = self.segments[-1] + 1 if self.segments else 1
+        self.current = open(self.SegmentPath(seq), "ab")
+        self.segments.append(seq)
+        self.sizes[seq] = 0
+        # make the new directory entry durable as well
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def Sync(self):
+        if self.current is not None:
+            self.current.flush()
+            os.fsync(self.current.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def Seal(self):
+        if self.current is not None:
+            self.Sync()
+            self.current.close()
+            self.current = None
+
+    def Evict(self):
+        # keep the newest points, drop whole segments starting with the oldest
+        while self.Size() > self.max_size and len(self.segments) > 1:
+            seq = self.segments.pop(0)
+            self.evicted += self.sizes.pop(seq)
+            self.offsets.pop(seq, None)
+            self.Remove(seq)
+            syslog.syslog(
+                syslog.LOG_WARNING,
+                "spool over {} bytes, evicted segment {} ({} bytes evicted so far)".format(
+                    self.max_size, seq, self.evicted
+                ),
+            )
+
+    def Remove(self, seq):
+        try:
+            os.remove(self.SegmentPath(seq))
+        except FileNotFoundError:
+            pass
+
+    def Replay(self):
+        # yield the spooled points oldest first in chunks of whole lines, asking
+        # for the next chunk acknowledges the previous one and a segment is
+        # deleted once all its chunks are acknowledged
+        with self.lock:
+            self.Seal()
+            segments = list(self.segments)
+        for seq in segments:
+            offset = self.offsets.get(seq, 0)
+            try:
+                segment = open(self.SegmentPath(seq), "rb")
+            except FileNotFoundError:
+                # evicted meanwhile
+                continue
+            with segment:
+                segment.seek(offset)
+                rest = b""
+                while True:
+                    block = segment.read(self.replay_chunk)
+                    if not block:
+                        # a torn last line left by a crash is dropped here
+                        break
+                    block = rest + block
+                    cut = block.rfind(b"\n") + 1
+                    rest = block[cut:]
+                    if cut == 0:
+                        continue
+                    yield block[:cut]
+                    offset += cut
+                    self.offsets[seq] = offset
+            with self.lock:
+                if seq in self.sizes:
+                    self.segments.remove(seq)
+                    del self.sizes[seq]
+                self.offsets.pop(seq, None)
+                self.Remove(seq)
+
+    def Close(self):
+        with self.lock:
+            self.Seal()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+
+LOADED = time.monotonic()
+
+
+def ProcessAge():
+    # seconds since the kernel started the process, so the interpreter start
+    # and the imports are counted too. Without /proc, since this module loaded.
+    try:
+        with open("/proc/self/stat", "r") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic() - LOADED
+
+
+class Startup:
+    # the age of the process at every startup milestone, in the order they
+    # were first reached: imports, config, init, first_sample, first_write
+    def __init__(self):
+        self.marks = []
+        self.reached = set()
+        self.lock = threading.Lock()
+
+    def Mark(self, name):
+        # true the first time name is reached only
+        if name in self.reached:
+            return False
+        with self.lock:
+            if name in self.reached:
+                return False
+            self.reached.add(name)
+            self.marks.append((name, ProcessAge()))
+            return True
+
+    def Breakdown(self):
+        # milestone -> seconds since the previous one
+        breakdown = []
+        previous = 0.0
+        for name, age in list(self.marks):
+            breakdown.append((name, age - previous))
+            previous = age
+        return breakdown
+
+    def Total(self):
+        return self.marks[-1][1] if self.marks else 0.0
+
+
+# marked by the writer and the runners, reported on the first write
+STARTUP = Startup()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+
+
+class Stage:
+    def __init__(self, window):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.max = 0.0
+
+    def Summary(self):
+        samples = sorted(self.samples) or [0]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": samples[int(len(samples) * 0.50)] * 1000,
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+            "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class Stats:
+    # monotonic clock durations of the hot path stages (poll_<command>,
+    # exchange_<command>, map_data, influx_write, jitter_<job>) over the last
+    # `window` samples of each, plus counters. Only created when the stats
+    # section is configured, callers skip the timing entirely without it.
+    def __init__(self, conf):
+        self.interval = conf.get("interval", 60)
+        self.window = conf.get("window", 1000)
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def Record(self, name, elapsed, failed=False):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = Stage(self.window)
+            stage.samples.append(elapsed)
+            stage.count += 1
+            if failed:
+                stage.errors += 1
+            if elapsed > stage.max:
+                stage.max = elapsed
+
+    def Count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def Set(self, name, value):
+        with self.lock:
+            self.counters[name] = value
+
+    def Snapshot(self):
+        with self.lock:
+            return {
+                "stages": {
+                    name: stage.Summary() for name, stage in self.stages.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+    def Points(self, time_ns):
+        # one influx_writer_stats point per stage, the counters in a last one
+        snapshot = self.Snapshot()
+        points = [
+            ("influx_writer_stats", (("stage", name),), fields, time_ns)
+            for name, fields in sorted(snapshot["stages"].items())
+        ]
+        if snapshot["counters"]:
+            points.append(
+                (
+                    "influx_writer_stats",
+                    (("stage", "counters"),),
+                    snapshot["counters"],
+                    time_ns,
+                )
+            )
+        return points
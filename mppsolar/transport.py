@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+import importlib
+import json
+import os
+import pi30
+import random
+import select
+import subprocess
+import syslog
+import time
+
+# realistic answers of an Axpert/PI30 inverter, as printed by `mppsolar -o json`
+FAKE_RESPONSES = {
+    "QPIGS": {
+        "ac_input_voltage": 231.4,
+        "ac_input_frequency": 49.9,
+        "ac_output_voltage": 230.1,
+        "ac_output_frequency": 50.0,
+        "ac_output_apparent_power": 552,
+        "ac_output_active_power": 498,
+        "ac_output_load": 11,
+        "bus_voltage": 392,
+        "battery_voltage": 52.6,
+        "battery_charging_current": 12,
+        "battery_capacity": 87,
+        "inverter_heat_sink_temperature": 38,
+        "pv_input_current_for_battery": 7,
+        "pv_input_voltage": 118.4,
+        "battery_voltage_from_scc": 52.61,
+        "battery_discharge_current": 0,
+        "is_sbu_priority_version_added": 0,
+        "is_configuration_changed": 0,
+        "is_scc_firmware_updated": 0,
+        "is_load_on": 1,
+        "is_battery_voltage_to_steady_while_charging": 0,
+        "is_charging_on": 1,
+        "is_scc_charging_on": 1,
+        "is_ac_charging_on": 0,
+        "rsv1": 0,
+        "rsv2": 0,
+        "pv_input_power": 829,
+        "is_charging_to_float": 0,
+        "is_switched_on": 1,
+        "is_reserved": 0,
+    },
+    "QPIRI": {
+        "ac_input_voltage": 230.0,
+        "ac_input_current": 21.7,
+        "ac_output_voltage": 230.0,
+        "ac_output_frequency": 50.0,
+        "ac_output_current": 21.7,
+        "ac_output_apparent_power": 5000,
+        "ac_output_active_power": 5000,
+        "battery_voltage": 48.0,
+        "battery_recharge_voltage": 46.0,
+        "battery_under_voltage": 42.0,
+        "battery_bulk_charge_voltage": 56.4,
+        "battery_float_charge_voltage": 54.0,
+        "battery_type": "Flooded",
+        "max_ac_charging_current": 30,
+        "max_charging_current": 60,
+        "input_voltage_range": "Appliance",
+        "output_source_priority": "Solar first",
+        "charger_source_priority": "Solar first",
+        "max_parallel_units": 9,
+        "machine_type": "Off Grid",
+        "topology": "transformerless",
+        "output_mode": "single machine output",
+        "battery_redischarge_voltage": 54.0,
+        "pv_ok_condition": "As long as one unit of inverters has connect PV, parallel system will consider PV OK",
+        "pv_power_balance": "PV input max power will be the sum of the max charged power and loads power",
+    },
+    "QPIWS": {
+        "reserved": 0,
+        "inverter_fault": 0,
+        "bus_over_fault": 0,
+        "bus_under_fault": 0,
+        "bus_soft_fail_fault": 0,
+        "line_fail_warning": 0,
+        "opv_short_warning": 0,
+        "inverter_voltage_too_low_fault": 0,
+        "inverter_voltage_too_high_fault": 0,
+        "over_temperature_fault": 0,
+        "fan_locked_fault": 0,
+        "battery_voltage_to_high_fault": 0,
+        "battery_low_alarm_warning": 0,
+        "battery_under_shutdown_warning": 0,
+        "overload_fault": 0,
+        "eeprom_fault": 0,
+        "inverter_over_current_fault": 0,
+        "inverter_soft_fail_fault": 0,
+        "self_test_fail_fault": 0,
+        "op_dc_voltage_over_fault": 0,
+        "bat_open_fault": 0,
+        "current_sensor_fail_fault": 0,
+        "battery_short_fault": 0,
+        "power_limit_warning": 0,
+        "pv_voltage_high_warning": 0,
+        "mppt_overload_fault": 0,
+        "mppt_overload_warning": 0,
+        "battery_too_low_to_charge_warning": 0,
+    },
+    "QFLAG": {
+        "buzzer": "enabled",
+        "overload_bypass": "disabled",
+        "power_saving": "disabled",
+        "lcd_reset_to_default": "enabled",
+        "overload_restart": "enabled",
+        "over_temperature_restart": "enabled",
+        "lcd_backlight": "enabled",
+        "primary_source_interrupt_alarm": "enabled",
+        "record_fault_code": "enabled",
+    },
+}
+
+
+class SubprocessTransport:
+    # spawn the mppsolar cli for every command, slow but needs nothing but the venv
+    def __init__(self, conf):
+        self.venv = conf["venv"]
+        self.path = conf["path"]
+        self.port = conf.get("port", "/dev/hidraw0")
+
+    def Send(self, command):
+        try:
+            inverter_data = subprocess.check_output(
+                [self.venv, self.path, "-p", self.port, "-o", "json", "-c", command]
+            )
+        except subprocess.CalledProcessError as e:
+            syslog.syslog(
+                syslog.LOG_ERR, "inverter_poller returned with error {}".format(e)
+            )
+            raise e
+        return json.loads(inverter_data.decode("utf-8"))
+
+    def Close(self):
+        pass
+
+
+class HidrawTransport:
+    # talk to the inverter from this process, the hidraw device stays open
+    # between commands and mppsolar is only used to build and decode frames
+    def __init__(self, conf):
+        self.port = conf.get("port", "/dev/hidraw0")
+        self.protocol_name = conf.get("protocol", "PI30").lower()
+        self.timeout = conf.get("timeout", 5)
+        self.protocol = None
+        self.fd = None
+
+    def Open(self):
+        if self.protocol is None:
+            module = importlib.import_module(
+                "mppsolar.protocols.{}".format(self.protocol_name)
+            )
+            self.protocol = getattr(module, self.protocol_name)()
+        if self.fd is None:
+            self.fd = os.open(self.port, os.O_RDWR | os.O_NONBLOCK)
+
+    def Send(self, command):
+        self.Open()
+        try:
+            response = self.Exchange(self.protocol.get_full_command(command))
+        except OSError as e:
+            # the device may have been unplugged, reopen it on the next command
+            syslog.syslog(syslog.LOG_ERR, "{} exchange failed: {}".format(self.port, e))
+            self.Close()
+            raise e
+        return self.Normalize(self.protocol.decode(response, command))
+
+    def Exchange(self, frame):
+        # drop anything left over from a previous timed out command
+        while select.select([self.fd], [], [], 0)[0]:
+            if not os.read(self.fd, 256):
+                break
+        # hidraw expects the command split in 8 bytes reports
+        for i in range(0, len(frame), 8):
+            os.write(self.fd, frame[i : i + 8])
+
+        response = b""
+        deadline = time.monotonic() + self.timeout
+        while b"\r" not in response:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    "no response from {} after {}s".format(self.port, self.timeout)
+                )
+            if select.select([self.fd], [], [], remaining)[0]:
+                response += os.read(self.fd, 256)
+        return response[: response.index(b"\r") + 1]
+
+    def Normalize(self, decoded):
+        # same shape as `mppsolar -o json`: lower_case keys and bare values
+        response = {}
+        for key, value in decoded.items():
+            if key.startswith("_") or key == "raw_response":
+                continue
+            if isinstance(value, list):
+                value = value[0]
+            response[key.lower().replace(" ", "_")] = value
+        return response
+
+    def Close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class NativeTransport(HidrawTransport):
+    # PI30 only: frames are built and decoded by the pi30 module, no mppsolar
+    # import and no json in between the device and the mapper
+    def Open(self):
+        if self.fd is None:
+            self.fd = os.open(self.port, os.O_RDWR | os.O_NONBLOCK)
+
+    def Send(self, command):
+        self.Open()
+        try:
+            response = self.Exchange(pi30.Frame(command))
+        except OSError as e:
+            syslog.syslog(syslog.LOG_ERR, "{} exchange failed: {}".format(self.port, e))
+            self.Close()
+            raise e
+        return pi30.Decode(command, response)
+
+
+class ChildTransport:
+    # one long lived poller process: commands are written on its stdin and it
+    # answers a json document per line on stdout, so nothing gets spawned per poll
+    def __init__(self, conf):
+        self.argv = conf.get("child") or [
+            conf["venv"],
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "poller-child.py"),
+            "-p",
+            conf.get("port", "/dev/hidraw0"),
+            "--protocol",
+            conf.get("protocol", "PI30"),
+        ]
+        self.timeout = conf.get("timeout", 5)
+        self.process = None
+        self.buffer = b""
+        self.spawned = False
+        self.restarts = 0
+
+    def Start(self):
+        if self.process is not None:
+            syslog.syslog(
+                syslog.LOG_WARNING,
+                "poller child exited with {}".format(self.process.returncode),
+            )
+            self.Kill()
+        if self.spawned:
+            self.restarts += 1
+            syslog.syslog(
+                syslog.LOG_WARNING,
+                "restarting poller child ({} restarts)".format(self.restarts),
+            )
+        self.process = subprocess.Popen(
+            self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0
+        )
+        self.spawned = True
+        self.buffer = b""
+
+    def Send(self, command):
+        if self.process is None or self.process.poll() is not None:
+            self.Start()
+        try:
+            self.process.stdin.write("{}\n".format(command).encode("utf-8"))
+            line = self.ReadLine()
+        except (OSError, EOFError) as e:
+            # hung or dead child, kill it so the next command gets a fresh one
+            syslog.syslog(
+                syslog.LOG_ERR, "poller child failed on {}: {}".format(command, e)
+            )
+            self.Kill()
+            raise e
+        response = json.loads(line.decode("utf-8"))
+        if "error" in response:
+            raise RuntimeError(
+                "poller child failed on {}: {}".format(command, response["error"])
+            )
+        return response
+
+    def ReadLine(self):
+        fd = self.process.stdout.fileno()
+        deadline = time.monotonic() + self.timeout
+        while b"\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    "poller child did not answer after {}s".format(self.timeout)
+                )
+            if select.select([fd], [], [], remaining)[0]:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise EOFError("poller child closed its output")
+                self.buffer += chunk
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line
+
+    def Kill(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process = None
+
+    def Close(self):
+        if self.process is None:
+            return
+        # the child exits by itself once its stdin is closed
+        self.process.stdin.close()
+        try:
+            self.process.wait(self.timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+
+class FakeTransport:
+    # test double answering canned responses, latency and failure ratio can be
+    # tuned to measure the writer without an inverter plugged in
+    def __init__(self, conf):
+        self.latency = conf.get("latency", 0)
+        self.failure_ratio = conf.get("failure_ratio", 0)
+        self.responses = conf.get("responses", FAKE_RESPONSES)
+        # answer recorded PI30 frames through the native decoder instead
+        self.frames = conf.get("frames", False)
+        # numeric fields drift by up to this ratio, like a live inverter
+        self.jitter = conf.get("jitter", 0)
+        self.calls = {}
+
+    def Drift(self, response):
+        for key, value in response.items():
+            if type(value) is float:
+                response[key] = round(
+                    value * (1 + random.uniform(-self.jitter, self.jitter)), 2
+                )
+            elif type(value) is int and value > 1:
+                response[key] = round(
+                    value * (1 + random.uniform(-self.jitter, self.jitter))
+                )
+        return response
+
+    def Send(self, command):
+        self.calls[command] = self.calls.get(command, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_ratio and random.random() < self.failure_ratio:
+            raise TimeoutError("fake inverter did not answer {}".format(command))
+        if self.frames:
+            return pi30.Decode(command, pi30.FIXTURES.get(command, b"(ACK9 \r"))
+        if command in self.responses:
+            if self.jitter:
+                return self.Drift(dict(self.responses[command]))
+            return dict(self.responses[command])
+        return {command.lower(): "ACK"}
+
+    def Close(self):
+        pass
+
+
+TRANSPORTS = {
+    "subprocess": SubprocessTransport,
+    "hidraw": HidrawTransport,
+    "native": NativeTransport,
+    "child": ChildTransport,
+    "fake": FakeTransport,
+}
+
+
+def NewTransport(conf):
+    kind = conf.get("transport", "auto")
+    if kind != "auto":
+        return TRANSPORTS[kind](conf)
+    # PI30 is decoded natively, other protocols prefer the in-process transport
+    # and fall back to the cli if mppsolar is only installed in its own venv
+    if conf.get("protocol", "PI30").upper() == "PI30":
+        return NativeTransport(conf)
+    try:
+        importlib.import_module("mppsolar.protocols")
+        return HidrawTransport(conf)
+    except ImportError as e:
+        syslog.syslog(
+            syslog.LOG_WARNING,
+            "mppsolar not importable ({}), falling back to subprocess".format(e),
+        )
+        return SubprocessTransport(conf)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# bit of the QPIWS answer, or of the Warnings string of inverter_poller ->
+# warning name, None for the reserved bits. The warnings of a device are kept
+# as a single integer with bit i set when the i-th character of the answer is
+# 1, raised and cleared warnings are then a single xor against the previous
+# mask.
+WARNING_BITS = (
+    "reserved",
+    "inverter_fault",
+    "bus_over_fault",
+    "bus_under_fault",
+    "bus_soft_fail_fault",
+    "line_fail_warning",
+    "opv_short_warning",
+    "inverter_voltage_too_low_fault",
+    "inverter_voltage_too_high_fault",
+    "over_temperature_fault",
+    "fan_locked_fault",
+    "battery_voltage_to_high_fault",
+    "battery_low_alarm_warning",
+    None,
+    "battery_under_shutdown_warning",
+    None,
+    "overload_fault",
+    "eeprom_fault",
+    "inverter_over_current_fault",
+    "inverter_soft_fail_fault",
+    "self_test_fail_fault",
+    "op_dc_voltage_over_fault",
+    "bat_open_fault",
+    "current_sensor_fail_fault",
+    "battery_short_fault",
+    "power_limit_warning",
+    "pv_voltage_high_warning",
+    "mppt_overload_fault",
+    "mppt_overload_warning",
+    "battery_too_low_to_charge_warning",
+)
+
+WARNING_INDEX = tuple(
+    (name, 1 << bit) for bit, name in enumerate(WARNING_BITS) if name is not None
+)
+
+
+def Parse(bits):
+    # "a0a1a2...": the first character is bit 0
+    return int(bits[::-1], 2) if bits else 0
+
+
+def FromResponse(response):
+    # the native decoder parses the mask straight from the answer, the json
+    # answers of mppsolar have a field per warning
+    mask = response.get("warning_mask")
+    if mask is None:
+        return FromFields(response)
+    return mask
+
+
+def ToFields(mask):
+    # a field per warning, 1 when raised, as the warning measurement holds them
+    return {name: 1 if mask & bit else 0 for name, bit in WARNING_INDEX}
+
+
+def FromFields(response):
+    # mask of a QPIWS answer of the json and subprocess transports
+    mask = 0
+    for name, bit in WARNING_INDEX:
+        if response.get(name):
+            mask |= bit
+    return mask
+
+
+def Names(mask):
+    names = []
+    while mask:
+        low = mask & -mask
+        bit = low.bit_length() - 1
+        if bit < len(WARNING_BITS) and WARNING_BITS[bit] is not None:
+            names.append(WARNING_BITS[bit])
+        mask ^= low
+    return names
+
+
+def Events(previous, mask, tags, time):
+    # a warning_event point per raised or cleared warning, tagged with its name
+    changed = previous ^ mask
+    points = []
+    for name in Names(changed & mask):
+        points.append(
+            ("warning_event", tags + (("warning", name),), {"active": True}, time)
+        )
+    for name in Names(changed & previous):
+        points.append(
+            ("warning_event", tags + (("warning", name),), {"active": False}, time)
+        )
+    return points